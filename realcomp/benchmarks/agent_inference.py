@@ -0,0 +1,78 @@
+#add parent dir to find package. Only needed for source code build, pip install doesn't need it.
+import os
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+os.sys.path.insert(0,parentdir)
+os.sys.path.insert(0,os.path.join(parentdir, "realcomp"))
+
+import argparse
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+"""
+Agent inference benchmark: per-step latency of DeepQAgent.choose_action
+(traced batch-of-one graph) against the model.predict path, on a small
+convolutional model with the inputs of the REALComp observations.
+
+    python realcomp/benchmarks/agent_inference.py --steps 500
+"""
+
+
+def build_model(num_joints=9, num_sensors=4, retina_shape=(240, 320, 3)):
+    retina = tf.keras.Input(retina_shape)
+    goal = tf.keras.Input(retina_shape)
+    joint_positions = tf.keras.Input((num_joints,))
+    touch_sensors = tf.keras.Input((num_sensors,))
+    images = tf.keras.layers.Concatenate()([retina, goal])
+    x = tf.keras.layers.Conv2D(16, 8, strides=4, activation="relu")(images)
+    x = tf.keras.layers.Conv2D(32, 4, strides=2, activation="relu")(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Concatenate()([x, joint_positions, touch_sensors])
+    x = tf.keras.layers.Dense(64, activation="relu")(x)
+    action = tf.keras.layers.Dense(num_joints)(x)
+    return tf.keras.Model([retina, goal, joint_positions, touch_sensors], action)
+
+
+def observation():
+    return {"retina": np.random.randint(0, 255, (240, 320, 3), dtype=np.uint8),
+            "joint_positions": np.random.randn(9),
+            "touch_sensors": np.random.rand(4)}
+
+
+def latencies(choose_action, observations, goal, warmup):
+    for obs in observations[:warmup]:
+        choose_action(obs, goal)
+    times = []
+    for obs in observations[warmup:]:
+        start = time.perf_counter()
+        choose_action(obs, goal)
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    from competition_submission.agent import DeepQAgent
+
+    np.random.seed(0)
+    agent = DeepQAgent(build_model())
+    observations = [observation() for _ in range(args.steps + args.warmup)]
+    goal = observation()["retina"]
+
+    for name, choose_action in [("predict", agent.choose_action_predict),
+                                ("traced", agent.choose_action)]:
+        times = latencies(choose_action, observations, goal, args.warmup)
+        print(json.dumps({"benchmark": "agent_inference", "path": name,
+            "steps": len(times),
+            "mean_ms": 1000*times.mean(),
+            "median_ms": 1000*np.median(times),
+            "p99_ms": 1000*np.percentile(times, 99)}))
@@ -0,0 +1,99 @@
+#add parent dir to find package. Only needed for source code build, pip install doesn't need it.
+import os
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+os.sys.path.insert(0,parentdir)
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+"""
+Env benchmark: REALCompEnv.step throughput with and without the retina
+rendering, and reset latency with and without the snapshot fast reset.
+The envs are headless (pybullet.DIRECT) and driven by a seeded random
+walk of the joints, so that runs on different branches are comparable.
+
+    python realcomp/benchmarks/env_step.py --steps 1000 --resets 20
+"""
+
+
+def summary(times):
+    times = np.array(times)
+    return {"mean_ms": 1000*times.mean(),
+            "median_ms": 1000*np.median(times),
+            "p99_ms": 1000*np.percentile(times, 99)}
+
+
+def step_times(env, steps, warmup, read):
+    ''' Time env.step on a random walk of the joints
+    @read the observation channels read after each step
+    '''
+    rng = np.random.RandomState(0)
+    action = np.zeros(env.action_space.shape[0])
+    times = []
+    for t in range(warmup + steps):
+        action += 0.1*np.pi*rng.randn(len(action))
+        action = np.clip(action, env.action_space.low, env.action_space.high)
+        start = time.perf_counter()
+        observation, _, _, _ = env.step(action)
+        for key in read:
+            observation[key]
+        times.append(time.perf_counter() - start)
+    return times[warmup:]
+
+
+def bench_step(steps, warmup, retina):
+    import gym
+    import pybullet
+    import realcomp
+    # a lazy observation without its retina read never renders it
+    env = gym.make("REALComp-v0", lazy_observation=not retina,
+            connection_mode=pybullet.DIRECT)
+    env.reset()
+    read = ["joint_positions", "touch_sensors"] + (["retina"] if retina else [])
+    times = step_times(env, steps, warmup, read)
+    env.close()
+    result = {"benchmark": "env_step", "retina": retina, "steps": steps,
+            "steps_per_s": len(times)/np.sum(times)}
+    result.update(summary(times))
+    return result
+
+
+def bench_reset(resets, fast_reset):
+    import gym
+    import pybullet
+    import realcomp
+    env = gym.make("REALComp-v0", fast_reset=fast_reset,
+            connection_mode=pybullet.DIRECT)
+    start = time.perf_counter()
+    env.reset()
+    first = time.perf_counter() - start
+    times = []
+    for k in range(resets):
+        step_times(env, 10, 0, [])
+        start = time.perf_counter()
+        env.reset()
+        times.append(time.perf_counter() - start)
+    env.close()
+    result = {"benchmark": "env_reset", "fast_reset": fast_reset,
+            "resets": resets, "first_ms": 1000*first}
+    result.update(summary(times))
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--resets", type=int, default=20)
+    args = parser.parse_args()
+
+    for retina in [True, False]:
+        print(json.dumps(bench_step(args.steps, args.warmup, retina)))
+    for fast_reset in [False, True]:
+        print(json.dumps(bench_reset(args.resets, fast_reset)))
@@ -0,0 +1,69 @@
+#add parent dir to find package. Only needed for source code build, pip install doesn't need it.
+import os
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+os.sys.path.insert(0,parentdir)
+os.sys.path.insert(0,os.path.join(parentdir, "realcomp"))
+
+import argparse
+import json
+
+import numpy as np
+
+"""
+Frame codec benchmark: compression ratio and encode/decode throughput of
+the replay frame codecs on retinas of a random-action rollout.
+
+    python realcomp/benchmarks/frame_codec.py --frames 1000
+"""
+
+
+def collect_frames(num_frames):
+    ''' Retinas of a rollout with a random walk of the joints
+    '''
+    import gym
+    import realcomp
+    env = gym.make("REALComp-v0")
+    observation = env.reset()
+    action = np.zeros(env.action_space.shape[0])
+    frames = []
+    for t in range(num_frames):
+        action += 0.1*np.pi*np.random.randn(env.action_space.shape[0])
+        action = np.clip(action, env.action_space.low, env.action_space.high)
+        observation, _, _, _ = env.step(action)
+        frames.append(observation["retina"].copy())
+    env.close()
+    return frames
+
+
+def run(frames, level, delta, batch_size, workers):
+    from competition_submission.utils.frame_codec import ZlibFrameCodec, CompressedFrameTable
+    table = CompressedFrameTable(len(frames), frames[0].shape,
+            ZlibFrameCodec(level=level, delta=delta), workers=workers)
+    for i, frame in enumerate(frames):
+        table[i] = frame
+    for _ in range(max(1, len(frames)//batch_size)):
+        table.take(np.random.randint(len(frames), size=batch_size))
+    table.close()
+    result = {"benchmark": "frame_codec", "level": level, "delta": delta,
+            "frames": len(frames), "batch_size": batch_size,
+            "workers": workers}
+    result.update(table.report())
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    frames = collect_frames(args.frames)
+    for level in [1, 6]:
+        for delta in [False, True]:
+            print(json.dumps(run(frames, level, delta, args.batch_size,
+                args.workers)))
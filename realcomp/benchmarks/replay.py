@@ -0,0 +1,158 @@
+#add parent dir to find package. Only needed for source code build, pip install doesn't need it.
+import os
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+os.sys.path.insert(0,parentdir)
+os.sys.path.insert(0,os.path.join(parentdir, "realcomp"))
+
+import argparse
+import json
+import resource
+import time
+
+import numpy as np
+
+"""
+Replay benchmark: ExperienceStore.insert_observation and
+get_memory_replay_batch throughput, select_new_goal latency as the store
+fills up to its memory size and keeps evicting past it, and the peak RSS
+per stored transition.
+
+Observations are synthetic (seeded smooth retinas, random joints and
+sensors), so that the store is measured without the env. Run
+one configuration per process, the RSS is the peak of the process.
+
+    python realcomp/benchmarks/replay.py --memory-size 10000
+    python realcomp/benchmarks/replay.py --memory-size 10000 --compress
+"""
+
+# fractions of the memory size at which select_new_goal is timed
+FILL_LEVELS = [0.1, 0.25, 0.5, 1.0, 1.5, 2.0]
+
+
+def peak_rss():
+    ''' :return: the peak resident set size of the process in bytes
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def make_observations(count, shape=(240, 320, 3), num_joints=9,
+        num_sensors=4):
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    observations = []
+    for k in range(count):
+        base = 127 + 100*np.sin(x/(20 + k) + y/(30 + 2*k))
+        retina = np.repeat(base[:, :, None], shape[2], axis=2)
+        observations.append({"retina": retina.astype(np.uint8),
+            "joint_positions": rng.randn(num_joints),
+            "touch_sensors": rng.rand(num_sensors),
+            "goal": np.zeros(shape, dtype=np.uint8)})
+    return observations
+
+
+def make_store(memory_size, compress, directory):
+    from competition_submission.utils.experience_store import ExperienceStore
+    from competition_submission.utils.frame_codec import ZlibFrameCodec
+    from competition_submission.utils.memmap_experience_store import MemmapExperienceStore
+    from competition_submission.utils.novelty import NoveltyEstimator
+    if directory is not None:
+        return MemmapExperienceStore(memory_size, directory, NoveltyEstimator())
+    return ExperienceStore(memory_size, NoveltyEstimator(),
+            frame_codec=ZlibFrameCodec() if compress else None)
+
+
+def summary(times):
+    times = np.array(times)
+    return {"mean_ms": 1000*times.mean(),
+            "median_ms": 1000*np.median(times),
+            "p99_ms": 1000*np.percentile(times, 99)}
+
+
+def run(memory_size, compress, directory, batch_size, batches, goal_samples,
+        pool_size):
+    from competition_submission.utils.experience_store import Goal
+
+    config = {"memory_size": memory_size, "compress": compress,
+            "memmap": directory is not None}
+    observations = make_observations(pool_size)
+    rss_before = peak_rss()
+    store = make_store(memory_size, compress, directory)
+    rng = np.random.RandomState(1)
+    goal = Goal(observations[0]["retina"], None, None)
+    results = []
+
+    inserted = 0
+    insert_time = 0
+    for level in FILL_LEVELS:
+        target = int(level*memory_size)
+        start = time.perf_counter()
+        while inserted < target:
+            previous = observations[inserted % pool_size]
+            current = observations[(inserted + 1) % pool_size]
+            store.insert_observation(previous, current, goal,
+                    rng.randn(len(previous["joint_positions"])))
+            inserted += 1
+        insert_time += time.perf_counter() - start
+
+        times = []
+        for k in range(goal_samples):
+            start = time.perf_counter()
+            goal = store.select_new_goal()
+            times.append(time.perf_counter() - start)
+        result = {"benchmark": "select_new_goal", "fill": level,
+                "stored": len(store), "samples": goal_samples}
+        result.update(config)
+        result.update(summary(times))
+        results.append(result)
+
+    result = {"benchmark": "insert_observation", "inserts": inserted,
+            "inserts_per_s": inserted/insert_time}
+    result.update(config)
+    results.insert(0, result)
+    rss_stored = peak_rss()
+
+    times = []
+    for k in range(batches):
+        start = time.perf_counter()
+        store.get_memory_replay_batch(batch_size)
+        times.append(time.perf_counter() - start)
+    result = {"benchmark": "get_memory_replay_batch", "batch_size": batch_size,
+            "batches": batches, "transitions_per_s": batch_size*batches/np.sum(times)}
+    result.update(config)
+    result.update(summary(times))
+    results.append(result)
+
+    stored = len(store)
+    # the store alone, then with the batches being sampled
+    result = {"benchmark": "peak_rss", "stored": stored,
+            "peak_rss_mb": peak_rss()/2**20,
+            "kb_per_transition": (rss_stored - rss_before)/stored/1024,
+            "kb_per_transition_sampling": (peak_rss() - rss_before)/stored/1024}
+    result.update(config)
+    results.append(result)
+    store.close()
+    return results
+
+
+if __name__ == "__main__":
+
+    from competition_submission.consts import MAX_MEMORY_SIZE, BATCH_SIZE
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memory-size", type=int, default=MAX_MEMORY_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--goal-samples", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=64,
+            help="number of distinct synthetic observations")
+    parser.add_argument("--compress", action="store_true",
+            help="keep the frames zlib compressed")
+    parser.add_argument("--directory",
+            help="use a memory-mapped store in this directory")
+    args = parser.parse_args()
+
+    for result in run(args.memory_size, args.compress, args.directory,
+            args.batch_size, args.batches, args.goal_samples, args.pool_size):
+        print(json.dumps(result))
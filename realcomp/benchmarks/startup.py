@@ -0,0 +1,80 @@
+#add parent dir to find package. Only needed for source code build, pip install doesn't need it.
+import os
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+os.sys.path.insert(0,parentdir)
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+"""
+Startup benchmark: time to first observation of a fresh process, with
+and without the asset cache. Every run is a new interpreter, so that
+nothing is shared with the previous ones.
+
+    python realcomp/benchmarks/startup.py --runs 5
+"""
+
+
+def first_observation(asset_cache):
+    ''' Measure the startup phases in the current process
+    '''
+    t0 = time.time()
+    import gym
+    import realcomp
+    t1 = time.time()
+    env = gym.make("REALComp-v0", asset_cache=asset_cache)
+    t2 = time.time()
+    env.reset()
+    t3 = time.time()
+    env.close()
+    return {"import": t1 - t0, "make": t2 - t1, "reset": t3 - t2,
+            "first_observation": t3 - t0,
+            "model": env.robot.model_urdf}
+
+
+def run_child(asset_cache):
+    out = subprocess.run(
+            [sys.executable, __file__, "--child",
+                "--asset-cache", str(int(asset_cache))],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--build", action="store_true",
+            help="build the asset cache before measuring")
+    parser.add_argument("--child", action="store_true",
+            help=argparse.SUPPRESS)
+    parser.add_argument("--asset-cache", type=int, default=1,
+            help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(first_observation(bool(args.asset_cache))))
+        sys.exit(0)
+
+    if args.build:
+        from realcomp.envs.asset_cache import build_asset_cache
+        build_asset_cache()
+
+    for asset_cache in [False, True]:
+        runs = [run_child(asset_cache) for _ in range(args.runs)]
+        result = {"benchmark": "startup", "asset_cache": asset_cache,
+                "model": runs[0]["model"], "runs": args.runs}
+        for phase in ["import", "make", "reset", "first_observation"]:
+            result[phase] = median([run[phase] for run in runs])
+        print(json.dumps(result))
@@ -0,0 +1,123 @@
+#add parent dir to find package. Only needed for source code build, pip install doesn't need it.
+import os
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+os.sys.path.insert(0,parentdir)
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+
+"""
+Benchmark suite of the env and replay hot paths: runs env_step.py and
+replay.py (one process per store configuration, the RSS being the peak
+of the process), tags every result with the commit and the machine and
+writes them as json lines, optionally comparing them to the results of
+another branch.
+
+    python realcomp/benchmarks/suite.py --output master.jsonl
+    git checkout my-branch
+    python realcomp/benchmarks/suite.py --output branch.jsonl --compare master.jsonl
+"""
+
+# the fields identifying a result, the other numeric fields are measures
+KEYS = ["benchmark", "retina", "fast_reset", "fill", "memory_size",
+        "compress", "memmap", "batch_size"]
+# measures that are better when higher, the others are better when lower
+HIGHER_IS_BETTER = ["steps_per_s", "inserts_per_s", "transitions_per_s"]
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                cwd=parentdir, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, universal_newlines=True,
+                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(script, arguments):
+    out = subprocess.run(
+            [sys.executable, os.path.join(currentdir, script)] + arguments,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout
+    return [json.loads(line) for line in out.splitlines()
+            if line.startswith("{")]
+
+
+def key(result):
+    return tuple(result.get(name) for name in KEYS)
+
+
+def compare(results, baseline):
+    ''' :return: the ratio of each measure to the baseline, > 1 when
+                 better than the baseline
+    '''
+    baseline = {key(result): result for result in baseline}
+    comparisons = []
+    for result in results:
+        base = baseline.get(key(result))
+        if base is None:
+            continue
+        ratios = {}
+        for name, value in result.items():
+            if name in KEYS or not isinstance(value, (int, float)) or \
+                    isinstance(value, bool) or not base.get(name):
+                continue
+            if not (name.endswith("_s") or name.endswith("_ms") or
+                    name.endswith("_mb") or name.startswith("kb_")):
+                continue
+            ratio = value/base[name]
+            ratios[name] = ratio if name in HIGHER_IS_BETTER else 1/ratio
+        comparison = {name: result[name] for name in KEYS
+                if result.get(name) is not None}
+        comparison.update(benchmark="compare", of=result["benchmark"],
+                ratios=ratios)
+        comparisons.append(comparison)
+    return comparisons
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="json lines file of the results")
+    parser.add_argument("--compare",
+            help="json lines file of the results to compare with")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--resets", type=int, default=20)
+    parser.add_argument("--memory-size", type=int)
+    parser.add_argument("--memmap-directory",
+            help="also benchmark a memory-mapped store in a temporary "
+            "directory created in this one")
+    args = parser.parse_args()
+
+    replay_arguments = [] if args.memory_size is None else \
+            ["--memory-size", str(args.memory_size)]
+    results = run_benchmark("env_step.py",
+            ["--steps", str(args.steps), "--resets", str(args.resets)])
+    for configuration in [[], ["--compress"]]:
+        results += run_benchmark("replay.py", replay_arguments + configuration)
+    if args.memmap_directory is not None:
+        with tempfile.TemporaryDirectory(dir=args.memmap_directory) as directory:
+            results += run_benchmark("replay.py",
+                    replay_arguments + ["--directory", directory])
+
+    tags = {"commit": commit(), "machine": platform.node(),
+            "python": platform.python_version()}
+    results = [dict(result, **tags) for result in results]
+    for result in results:
+        print(json.dumps(result))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = [json.loads(line) for line in f if line.strip()]
+        for comparison in compare(results, baseline):
+            print(json.dumps(comparison))
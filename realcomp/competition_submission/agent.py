@@ -1,36 +1,94 @@
+import numpy as np
 import tensorflow as tf
-from tensorflow.python.keras.models import load_model
+from tensorflow.keras.models import load_model
 
 from competition_submission.consts import RETINA, JOINT_POSITIONS, TOUCH_SENSORS
 from competition_submission.utils.experience_store import ExperienceBatch
 
 
+def model_inputs(retinas, goal_retinas, joint_positions, touch_sensors, retina_scale):
+    """
+    the inputs of the model in its order, shared by inference and training so that the model sees the same inputs in
+    both: the uint8 retinas are cast to float32 and scaled by retina_scale
+    :param retinas: batch of retinas, uint8
+    :param goal_retinas: batch of goal retinas, uint8
+    :param joint_positions: batch of joint positions
+    :param touch_sensors: batch of touch sensors
+    :param retina_scale: float - the factor applied to the retinas
+    :return: list - the tensors [retinas, goal retinas, joint positions, touch sensors]
+    """
+    return [tf.cast(retinas, tf.float32)*retina_scale,
+            tf.cast(goal_retinas, tf.float32)*retina_scale,
+            tf.cast(joint_positions, tf.float32),
+            tf.cast(touch_sensors, tf.float32)]
+
+
 class DeepQAgent:
-    def __init__(self, model):
+    """
+    The model takes [retina, goal retina, joint positions, touch sensors] with the retinas scaled by retina_scale,
+    as built by model_inputs on inference and training. choose_action runs a traced graph on preallocated batch-of-one
+    buffers: the uint8 retinas are fed as they are and scaled inside the graph, which avoids the per-call setup of
+    model.predict.
+    """
+    def __init__(self, model, retina_scale=1/255):
+        """
+        :param model: the keras model
+        :param retina_scale: float - the factor applied to the uint8 retinas before they are fed to the model
+        """
         self.model = model
+        self.retina_scale = retina_scale
+        # batch of one input buffers, in the order of the model inputs
+        self.inputs = [np.zeros((1,) + tuple(model_input.shape[1:]), dtype=dtype)
+                       for model_input, dtype in zip(model.inputs, [np.uint8, np.uint8, np.float32, np.float32])]
+        self.infer = tf.function(self._infer, input_signature=[
+            tf.TensorSpec(shape=buffer.shape, dtype=buffer.dtype) for buffer in self.inputs])
+
+    def _infer(self, retina, goal, joint_positions, touch_sensors):
+        return self.model(model_inputs(retina, goal, joint_positions, touch_sensors, self.retina_scale), training=False)
 
     def choose_action(self, observation, goal):
-        inputs = [
-            observation[RETINA],
-            goal,
-            observation[JOINT_POSITIONS],
-            observation[TOUCH_SENSORS]
-        ]
-        output = self.model.predict(inputs)
+        for buffer, value in zip(self.inputs, [observation[RETINA], goal, observation[JOINT_POSITIONS],
+                                               observation[TOUCH_SENSORS]]):
+            np.copyto(buffer[0], value, casting="unsafe")
+        output = self.infer(*self.inputs)
+        if isinstance(output, (list, tuple)):
+            output = [tensor.numpy() for tensor in output]
+        else:
+            output = output.numpy()
         return output[-1]
 
-    def training_step(self, experience_batch):
+    def choose_action_predict(self, observation, goal):
+        """
+        the same as choose_action through model.predict, kept as the reference of the inference benchmark
+        """
+        inputs = model_inputs(np.asarray(observation[RETINA])[None], np.asarray(goal)[None],
+                              np.asarray(observation[JOINT_POSITIONS])[None],
+                              np.asarray(observation[TOUCH_SENSORS])[None], self.retina_scale)
+        output = self.model.predict(inputs, verbose=0)
+        return output[-1]
+
+    def training_inputs(self, experience_batch):
+        """
+        :param experience_batch: ExperienceBatch - the experiences trained on
+        :return: list - the inputs of the model for the initial states of the experiences
+        """
         assert isinstance(experience_batch, ExperienceBatch)
-        inputs = [
-            experience_batch.initial_joint_positions,
-            experience_batch.initial_touch_sensors,
-            experience_batch.initial_retinas,
-            experience_batch.goal_retinas
-        ]
+        return model_inputs(experience_batch.initial_retinas, experience_batch.goal_retinas,
+                            experience_batch.initial_joint_positions, experience_batch.initial_touch_sensors,
+                            self.retina_scale)
+
+    def training_step(self, experience_batch):
+        inputs = self.training_inputs(experience_batch)
         outputs = [
             experience_batch.rewards
         ]
-        return self.model.train_on_batch(x=inputs, y=outputs, reset_metrics=False)
+        return self.model.train_on_batch(x=inputs, y=outputs)
+
+    def get_weights(self):
+        return self.model.get_weights()
+
+    def set_weights(self, weights):
+        self.model.set_weights(weights)
 
     def save_agent(self, filename):
         self.model.save(filename)
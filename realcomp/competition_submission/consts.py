@@ -4,7 +4,37 @@ RETINA = "retina"
 GOAL = "goal"
 
 MAX_STEPS_PER_GOAL = 1000
-GOAL_THRESHOLD = 0.1
+# mse between the retina and the goal retina, both normalized to [0, 1] (0.1 on the raw 0-255 scale)
+GOAL_THRESHOLD = 0.1/255**2
+# compare frames through small embeddings (goal proximity, rewards and knn novelty) instead of full frames
+USE_EMBEDDINGS = False
+EMBEDDING_DOWNSAMPLE = 8
+EMBEDDING_DIM = 64
+GOAL_EMBEDDING_THRESHOLD = 0.001
+NOVELTY_NEIGHBOURS = 10
+# the last frames the knn novelty is measured against, each insert scans all of them
+NOVELTY_INDEX_SIZE = 10000
 MAX_MEMORY_SIZE = 10000
+# directory of a disk-backed replay memory, None to keep it in RAM
+REPLAY_DIRECTORY = None
+# inserts between two flushes of a disk-backed replay memory
+REPLAY_FLUSH_INTERVAL = 10000
+# subsampling step of the frames scored for novelty
+NOVELTY_DOWNSAMPLE = 1
+# keep the replay frames zlib compressed in RAM, at the cost of decoding every sampled batch: 408 ms per batch of
+# BATCH_SIZE experiences against 27 ms uncompressed in benchmarks/replay.py
+COMPRESS_FRAMES = False
 
 BATCH_SIZE = 128
+# replay batches assembled ahead in a background thread, 0 to sample them in the control loop
+PREFETCH_BATCHES = 0
+# fraction of the replayed experiences relabeled with a goal reached up to HINDSIGHT_HORIZON steps later
+HINDSIGHT_PROBABILITY = 0.0
+HINDSIGHT_HORIZON = 50
+# training steps of the background learner per env step, the learner is used when an agent and a learner agent are
+# set on the controller
+LEARNER_UPDATES_PER_STEP = 0.25
+# training steps between two publications of the learner weights to the actor
+LEARNER_PUBLISH_INTERVAL = 100
+# training steps the learner may lag behind before the actor waits for it, None to never wait
+LEARNER_MAX_PENDING_UPDATES = None
@@ -0,0 +1,184 @@
+import argparse
+import json
+import multiprocessing as mp
+import queue
+import time
+import traceback
+
+import numpy as np
+import pybullet
+import realcomp
+import gym
+import os
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+os.sys.path.insert(0,parentdir)
+from my_controller import MyController
+from competition_submission.consts import RETINA
+from competition_submission.utils.checkpoint import Checkpointer
+from competition_submission.utils.helper_functions import mse
+
+Controller = MyController
+
+
+def run_trial(env, controller, goal_idx, seed=0):
+    """
+    runs one extrinsic trial the way demo_run does: reset, set the goal, step the controller until done
+    :param env: REALCompEnv - the env, with its extrinsic_timesteps set
+    :param controller: ControllerWrapper - the controller choosing the actions
+    :param goal_idx: int - the index of the goal of the trial
+    :param seed: int - the numpy seed of the trial is seed + goal_idx, so that it does not depend on the worker
+    :return: dict - the result of the trial
+    """
+    np.random.seed(seed + goal_idx)
+    start = time.time()
+    observation = env.reset()
+    reward = 0
+    done = False
+    env.set_goal(goal_idx)
+    steps = 0
+    while not done:
+        action = controller.step(observation, reward, done)
+        observation, reward, done, _ = env.step(action)
+        steps += 1
+
+    goal = env.goal
+    result = {"goal_idx": goal_idx, "steps": steps, "seconds": time.time() - start,
+              "retina_mse": float(mse(np.asarray(observation[RETINA], dtype=np.float32)/255,
+                                      np.asarray(goal.retina, dtype=np.float32)/255))}
+    positions = env.unwrapped.get_obj_states()[:, :3]
+    final_state = np.asarray(goal.final_state)
+    if final_state.shape == positions.shape:
+        result["object_distance"] = float(np.linalg.norm(positions - final_state, axis=1).mean())
+    return result
+
+
+def make_controller(controller_class, action_space, checkpoint_directory=None):
+    """
+    :param controller_class: the class of the controller, instantiated with the action space
+    :param action_space: the action space of the env
+    :param checkpoint_directory: string - the directory of a Checkpointer run the controller is restored from, if not
+                                 None
+    :return: ControllerWrapper - the controller every trial starts from
+    """
+    controller = controller_class(action_space)
+    if checkpoint_directory is not None:
+        controller.initialize_experience_store()
+        Checkpointer(checkpoint_directory, controller.experience_store, controller).restore()
+    return controller
+
+
+def _worker(worker, goal_indices, controller_class, checkpoint_directory, extrinsic_timesteps, seed, results):
+    """
+    evaluation worker: owns one env and runs its trials in order, each with a new controller, putting each result on
+    the queue
+    """
+    try:
+        env = gym.make('REALComp-v0', connection_mode=pybullet.DIRECT)
+        env.extrinsic_timesteps = extrinsic_timesteps
+        for goal_idx in goal_indices:
+            # the state a controller builds up during a trial must not carry over to the next trial of the worker,
+            # whose trials depend on the number of workers
+            controller = make_controller(controller_class, env.action_space, checkpoint_directory)
+            result = run_trial(env, controller, goal_idx, seed)
+            controller.close()
+            result["worker"] = worker
+            results.put(result)
+        env.close()
+    except Exception:
+        results.put({"worker": worker, "error": traceback.format_exc()})
+    # the id of the worker ends its results
+    results.put(worker)
+
+
+def evaluate(goal_indices, workers=4, controller_class=Controller, checkpoint_directory=None,
+             extrinsic_timesteps=1000, seed=0, poll_interval=1.0):
+    """
+    runs extrinsic trials in a pool of worker processes, each with its own env. Worker k runs the goals
+    goal_indices[k::workers] in order, every trial with a new controller restored from the checkpoint, so that the
+    results do not depend on the number of workers.
+    :param goal_indices: list - the indices of the goals to evaluate
+    :param workers: int - the number of worker processes
+    :param controller_class: the class of the controller, instantiated with the action space for each trial
+    :param checkpoint_directory: string - the directory of a Checkpointer run the controllers are restored from, if
+                                 not None
+    :param extrinsic_timesteps: int - the length of a trial
+    :param seed: int - the base numpy seed of the trials
+    :param poll_interval: float - seconds between the checks that the workers are alive, a worker that exits without
+                          ending its results raises a RuntimeError
+    :return: generator - the result of each trial, as soon as it is done
+    """
+    goal_indices = list(goal_indices)
+    workers = max(1, min(workers, len(goal_indices)))
+    results = mp.Queue()
+    processes = [mp.Process(target=_worker, args=(k, goal_indices[k::workers], controller_class,
+                                                  checkpoint_directory, extrinsic_timesteps, seed, results),
+                            daemon=True)
+                 for k in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        running = set(range(workers))
+        while len(running) > 0:
+            # checked before waiting, so that the results a worker put before it exited are read first
+            exited = [k for k in sorted(running) if not processes[k].is_alive()]
+            try:
+                result = results.get(timeout=poll_interval)
+            except queue.Empty:
+                if len(exited) > 0:
+                    raise RuntimeError("evaluation worker %d exited with code %s before its last trial"
+                                       % (exited[0], processes[exited[0]].exitcode))
+                continue
+            if isinstance(result, int):
+                running.discard(result)
+            elif "error" in result:
+                raise RuntimeError("evaluation worker %d failed:\n%s" % (result["worker"], result["error"]))
+            else:
+                yield result
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+def aggregate(results):
+    """
+    :param results: list - trial results returned by evaluate
+    :return: dict - the number of trials and the mean and median of the trial measures
+    """
+    summary = {"trials": len(results)}
+    for name in ["retina_mse", "object_distance", "seconds"]:
+        values = [result[name] for result in results if name in result]
+        if len(values) > 0:
+            summary["mean_" + name] = float(np.mean(values))
+            summary["median_" + name] = float(np.median(values))
+    return summary
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=mp.cpu_count())
+    parser.add_argument("--trials", type=int, help="evaluate the first trials goals, all the goals if not set")
+    parser.add_argument("--checkpoint", help="directory of the checkpoints to evaluate")
+    parser.add_argument("--extrinsic-timesteps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="json lines file the trial results are appended to")
+    args = parser.parse_args()
+
+    env = gym.make('REALComp-v0')
+    num_goals = len(env.unwrapped.load_goals())
+    env.close()
+    trials = num_goals if args.trials is None else min(args.trials, num_goals)
+
+    results = []
+    for result in evaluate(range(trials), args.workers, checkpoint_directory=args.checkpoint,
+                           extrinsic_timesteps=args.extrinsic_timesteps, seed=args.seed):
+        results.append(result)
+        print(json.dumps(result))
+        if args.output is not None:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
+    print(json.dumps(aggregate(sorted(results, key=lambda result: result["goal_idx"]))))
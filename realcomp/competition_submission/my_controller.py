@@ -1,10 +1,19 @@
-import time
-
 import numpy as np
 
-from competition_submission.consts import GOAL, RETINA, MAX_MEMORY_SIZE, GOAL_THRESHOLD, BATCH_SIZE, MAX_STEPS_PER_GOAL
+from competition_submission.consts import GOAL, RETINA, JOINT_POSITIONS, TOUCH_SENSORS, MAX_MEMORY_SIZE, \
+    GOAL_THRESHOLD, BATCH_SIZE, MAX_STEPS_PER_GOAL, REPLAY_DIRECTORY, REPLAY_FLUSH_INTERVAL, NOVELTY_DOWNSAMPLE, \
+    PREFETCH_BATCHES, COMPRESS_FRAMES, USE_EMBEDDINGS, EMBEDDING_DOWNSAMPLE, EMBEDDING_DIM, GOAL_EMBEDDING_THRESHOLD, \
+    NOVELTY_NEIGHBOURS, NOVELTY_INDEX_SIZE, HINDSIGHT_PROBABILITY, HINDSIGHT_HORIZON, LEARNER_UPDATES_PER_STEP, \
+    LEARNER_PUBLISH_INTERVAL, LEARNER_MAX_PENDING_UPDATES
+from competition_submission.utils.embedding_index import FrameEmbedder
 from competition_submission.utils.experience_store import ExperienceStore, Goal
+from competition_submission.utils.frame_codec import ZlibFrameCodec
+from competition_submission.utils.learner import AsyncLearner
+from competition_submission.utils.memmap_experience_store import MemmapExperienceStore
+from competition_submission.utils.novelty import NoveltyEstimator, KnnNoveltyEstimator
+from competition_submission.utils.prefetch_sampler import PrefetchSampler
 from competition_submission.utils.helper_functions import mse
+from realcomp.instrumentation import DECISION, STORE_INSERT, BATCH_SAMPLING, TRAINING
 
 
 class ControllerWrapper:
@@ -26,7 +35,12 @@ class ControllerWrapper:
         self.steps_per_goal = MAX_STEPS_PER_GOAL
         self.experience_store = None
         self.experience_store_initialized = False
-        self.time = time.time()
+        self.replay_sampler = None
+        self.agent = None
+        self.learner_agent = None
+        self.learner = None
+        self.embedder = FrameEmbedder(EMBEDDING_DOWNSAMPLE, EMBEDDING_DIM) if USE_EMBEDDINGS else None
+        self.profiler = None
 
     def step(self, observation, reward, done):
         """
@@ -37,7 +51,7 @@ class ControllerWrapper:
         :return: None
         """
         if not self.experience_store_initialized:
-            self._initialize_experience_store()
+            self.initialize_experience_store()
         if self._is_testing_step(observation[GOAL]):
             self._save_memory(observation, True)
             return self._choose_action(observation, reward, done)
@@ -57,6 +71,9 @@ class ControllerWrapper:
                                                      observation,
                                                      self.goal,
                                                      self.action)
+            if hasattr(self.experience_store, "flush") and \
+                    self.experience_store.observation_number % REPLAY_FLUSH_INTERVAL == 0:
+                self.experience_store.flush()
         if is_testing_step:
             self.goal = Goal(observation[GOAL], None, None)
         elif self.goal is None:
@@ -72,7 +89,10 @@ class ControllerWrapper:
         :param observation: observation object returned by env.set(action)
         :return: None
         """
-        return mse(self.goal.retina, observation[RETINA]) < GOAL_THRESHOLD
+        if self.embedder is not None:
+            return mse(self.embedder.embed_goal(self.goal), self.embedder(observation[RETINA])) < \
+                GOAL_EMBEDDING_THRESHOLD
+        return mse(self.goal.retina, observation[RETINA])/255**2 < GOAL_THRESHOLD
 
     def _choose_action(self, observation, reward, done):
         """
@@ -85,7 +105,8 @@ class ControllerWrapper:
         # TODO: build the Deep Q agent and replace the below random movement
         proposed_action = self.action + 0.1*np.pi*np.random.randn(self.action_space.shape[0])
         self.action = np.maximum(np.minimum(proposed_action, self.action_space.high), self.action_space.low)
-        self.previous_state = observation
+        # the channels inserted in the store at the next step, read now as a lazy observation expires with the step
+        self.previous_state = {key: observation[key] for key in [RETINA, JOINT_POSITIONS, TOUCH_SENSORS]}
         return self.action
 
     def _perform_training_step(self, observation, reward, done):
@@ -97,10 +118,16 @@ class ControllerWrapper:
         :return: list describing the action to perform
         """
         if self.experience_store_initialized and self.experience_store.observation_number > 0:
-            print(time.time() - self.time)
-            self.time = time.time()
-            batch_data = self.experience_store.get_memory_replay_batch(BATCH_SIZE)
-            # TODO: build the Deep Q agent
+            if self.learner is not None:
+                self.learner.actor_step(self.agent)
+            else:
+                if self.replay_sampler is not None:
+                    batch_data = self.replay_sampler.get_batch()
+                else:
+                    batch_data = self.experience_store.get_memory_replay_batch(
+                        BATCH_SIZE, hindsight_probability=HINDSIGHT_PROBABILITY, hindsight_horizon=HINDSIGHT_HORIZON)
+                if self.agent is not None:
+                    self.agent.training_step(batch_data)
         action = self._choose_action(observation, reward, done)
         return action
 
@@ -111,12 +138,120 @@ class ControllerWrapper:
         """
         return np.max(goal) != 0 and np.min(goal) != 0
 
-    def _initialize_experience_store(self):
+    def set_agent(self, agent, learner_agent=None):
+        """
+        sets the agent trained on the replayed experiences. With a learner agent, a copy of the same model, training
+        runs in a background thread on the learner agent and its weights are published to the agent periodically
+        :param agent: DeepQAgent - the agent used by the control loop
+        :param learner_agent: DeepQAgent - the agent trained in the background, None to train agent in the control loop
+        """
+        self.agent = agent
+        self.learner_agent = learner_agent
+        if self.experience_store_initialized:
+            self._start_learner()
+        self._instrument()
+
+    def instrument(self, profiler):
+        """
+        times the controller decision, the store inserts, the batch sampling and the training steps
+        :param profiler: realcomp.instrumentation.Profiler - the profiler the durations are recorded by
+        """
+        self.profiler = profiler
+        self._instrument()
+
+    def _instrument(self):
+        """
+        wraps the methods of the current store, sampler and agents, called again when they are replaced
+        """
+        if self.profiler is None:
+            return
+        self.profiler.wrap(self, "_choose_action", DECISION)
+        if self.experience_store is not None:
+            self.profiler.wrap(self.experience_store, "insert_observation", STORE_INSERT)
+            self.profiler.wrap(self.experience_store, "get_memory_replay_batch", BATCH_SAMPLING)
+        if self.replay_sampler is not None:
+            self.profiler.wrap(self.replay_sampler, "get_batch", BATCH_SAMPLING)
+        for agent in [self.agent, self.learner_agent]:
+            if agent is not None:
+                self.profiler.wrap(agent, "training_step", TRAINING)
+
+    def _start_learner(self):
+        if self.learner is not None:
+            self.learner.close()
+            self.learner = None
+        if self.learner_agent is not None:
+            self.learner_agent.set_weights(self.agent.get_weights())
+            self.learner = AsyncLearner(self.experience_store, self.learner_agent, BATCH_SIZE, self.replay_sampler,
+                                        LEARNER_UPDATES_PER_STEP, LEARNER_PUBLISH_INTERVAL,
+                                        LEARNER_MAX_PENDING_UPDATES, HINDSIGHT_PROBABILITY, HINDSIGHT_HORIZON)
+
+    def close(self):
+        """
+        stops the background threads and closes the experience store, flushing a disk-backed one
+        """
+        if self.learner is not None:
+            self.learner.close()
+            self.learner = None
+        if self.replay_sampler is not None:
+            self.replay_sampler.close()
+            self.replay_sampler = None
+        if self.experience_store is not None:
+            self.experience_store.close()
+        self.experience_store = None
+        self.experience_store_initialized = False
+
+    def get_checkpoint_state(self):
+        """
+        :return: dict - the arrays needed to resume the goal bookkeeping with set_checkpoint_state
+        """
+        state = {"steps_on_current_goal": np.asarray(self.steps_on_current_goal), "action": self.action.copy()}
+        if self.goal is not None:
+            state["goal_retina"] = np.array(self.goal.retina)
+            if self.goal.joint_positions is not None:
+                state["goal_joint_positions"] = np.array(self.goal.joint_positions)
+                state["goal_touch_sensors"] = np.array(self.goal.touch_sensors)
+        return state
+
+    def set_checkpoint_state(self, state):
+        """
+        :param state: dict - a state returned by get_checkpoint_state
+        """
+        self.steps_on_current_goal = int(state["steps_on_current_goal"])
+        self.action = state["action"]
+        self.previous_state = None
+        self.goal = None
+        if "goal_retina" in state:
+            self.goal = Goal(state["goal_retina"], state.get("goal_joint_positions"), state.get("goal_touch_sensors"))
+        # the learner trains a copy of the agent, it restarts from the weights the agent was restored with
+        if self.learner is not None:
+            self._start_learner()
+
+    def initialize_experience_store(self):
         """
-        initializes the database where the memories will be stored for memory replay
+        initializes the database where the memories will be stored for memory replay. Called on the first step, or
+        before restoring a checkpoint into the store
         """
-        self.experience_store = ExperienceStore(MAX_MEMORY_SIZE)
+        if self.embedder is not None:
+            novelty_estimator = KnnNoveltyEstimator(min(MAX_MEMORY_SIZE, NOVELTY_INDEX_SIZE), self.embedder,
+                                                    NOVELTY_NEIGHBOURS)
+        else:
+            novelty_estimator = NoveltyEstimator(NOVELTY_DOWNSAMPLE)
+        # frames pinned by the batch being prefetched
+        reserved_frames = 3*BATCH_SIZE if PREFETCH_BATCHES > 0 else 0
+        if REPLAY_DIRECTORY is not None:
+            self.experience_store = MemmapExperienceStore(MAX_MEMORY_SIZE, REPLAY_DIRECTORY, novelty_estimator,
+                                                          reserved_frames, self.embedder)
+        else:
+            frame_codec = ZlibFrameCodec() if COMPRESS_FRAMES else None
+            self.experience_store = ExperienceStore(MAX_MEMORY_SIZE, novelty_estimator, reserved_frames, frame_codec,
+                                                    self.embedder)
+        if PREFETCH_BATCHES > 0:
+            self.replay_sampler = PrefetchSampler(self.experience_store, BATCH_SIZE, PREFETCH_BATCHES,
+                                                  hindsight_probability=HINDSIGHT_PROBABILITY,
+                                                  hindsight_horizon=HINDSIGHT_HORIZON)
         self.experience_store_initialized = True
+        self._instrument()
+        self._start_learner()
 
 
 MyController = ControllerWrapper
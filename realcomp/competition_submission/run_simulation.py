@@ -11,14 +11,20 @@ currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentfram
 parentdir = os.path.dirname(os.path.dirname(currentdir))
 os.sys.path.insert(0,parentdir)
 from my_controller import MyController
+from competition_submission.utils.checkpoint import Checkpointer
+from realcomp.instrumentation import Profiler, instrument_env
 
 Controller = MyController
 
 
-def demo_run(extrinsic_trials=10):
+def demo_run(extrinsic_trials=10, checkpoint_directory=None, checkpoint_interval=100000, profile_file=None,
+             profile_interval=10000, agent=None, learner_agent=None):
 
     env = gym.make('REALComp-v0')
     controller = Controller(env.action_space)
+    # the DeepQAgent trained by the controller, checkpointed with it
+    if agent is not None:
+        controller.set_agent(agent, learner_agent)
     
     env.intrinsic_timesteps = 10*1000*1000 # 10 million timesteps
     env.extrinsic_timesteps = 1000
@@ -31,6 +37,22 @@ def demo_run(extrinsic_trials=10):
     reward = 0 
     done = False
 
+    # resume from the latest checkpoint, if any
+    checkpointer = None
+    if checkpoint_directory is not None:
+        controller.initialize_experience_store()
+        checkpointer = Checkpointer(checkpoint_directory, controller.experience_store, controller, env=env,
+                                    interval=checkpoint_interval)
+        if checkpointer.restore():
+            print("Resuming intrinsic phase at timestep %d..." % env.timestep)
+
+    # per-phase timings, appended to profile_file every profile_interval steps
+    profiler = None
+    if profile_file is not None:
+        profiler = Profiler(profile_file, profile_interval)
+        instrument_env(profiler, env)
+        controller.instrument(profiler)
+
     # intrinsic phase
     print("Starting intrinsic phase...")
     while not done:
@@ -39,9 +61,14 @@ def demo_run(extrinsic_trials=10):
         action = controller.step(observation, reward, done)
         # do action
         observation, reward, done, _ = env.step(action)
+        if checkpointer is not None:
+            checkpointer.step()
         
         # get frames for video making
         # rgb_array = env.render('rgb_array')
+
+    if checkpointer is not None:
+        checkpointer.wait()
         
     # extrinsic phase
     print("Starting extrinsic phase...")
@@ -67,5 +94,10 @@ def demo_run(extrinsic_trials=10):
             # get frames for video making
             # rgb_array = env.render('rgb_array')
 
+    if profiler is not None:
+        profiler.close()
+    controller.close()
+    env.close()
+
 if __name__=="__main__":
     demo_run()
@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from competition_submission.utils.experience_store import STATE_FIELDS, SCALAR_FIELDS, FRAME_FIELDS
+
+META_FILE = "meta.json"
+FRAMES_FILE = "frames.npy"
+# one .npy file per field of the store in this directory of a slot
+FIELDS_DIRECTORY = "fields"
+NOVELTY_FILE = "novelty.npz"
+CONTROLLER_FILE = "controller.npz"
+AGENT_FILE = "agent.npz"
+SLOTS = ["slot_0", "slot_1"]
+ROW_FIELDS = list(STATE_FIELDS.keys()) + list(SCALAR_FIELDS.keys())
+FRAME_CHUNK = 64
+
+
+class Checkpointer:
+    """
+    Periodic checkpoints of a run: the experience store (arrays, frames and novelty state), the controller goal state,
+    the agent weights and the env step count.
+
+    Checkpoints alternate between two slots, each one incremental: only the rows and frames of the experiences
+    inserted since the last checkpoint of the slot are written, the rows being copied when the checkpoint is taken
+    (with the novelty scores, which change in place) and the frames by a background thread while the simulation goes
+    on. A frame about to be overwritten by an insert before the thread wrote it is copied aside first, so that the
+    checkpoint is consistent. The meta file of a slot is removed while it is written and written last, so a crash
+    always leaves a complete checkpoint to resume from.
+    """
+    def __init__(self, directory, experience_store, controller=None, agent=None, env=None, interval=100000):
+        """
+        :param directory: string - where the checkpoints are kept, created if needed
+        :param experience_store: ExperienceStore - the store to checkpoint
+        :param controller: ControllerWrapper - its goal state is checkpointed, if not None
+        :param agent: DeepQAgent - its weights are checkpointed, the agent of the controller at the time of the
+                      checkpoint or restore if None
+        :param env: REALCompEnv - its timestep is checkpointed, if not None
+        :param interval: int - the number of calls to step() between two checkpoints
+        """
+        self.directory = directory
+        self.experience_store = experience_store
+        self.controller = controller
+        self.agent = agent
+        self.env = env
+        self.interval = interval
+        self.steps = 0
+        self.writer = None
+        self.pending_frames = set()
+        self.preserved_frames = {}
+        # observation number of the last checkpoint of each slot
+        self.written = {slot: self._read_meta(slot).get("observation_number", 0) for slot in SLOTS}
+        self.next_slot = min(SLOTS, key=lambda slot: self.written[slot])
+
+    def _path(self, slot, filename):
+        return os.path.join(self.directory, slot, filename)
+
+    def _read_meta(self, slot):
+        if not os.path.exists(self._path(slot, META_FILE)):
+            return {}
+        with open(self._path(slot, META_FILE)) as f:
+            return json.load(f)
+
+    def _field_path(self, slot, name):
+        return os.path.join(self.directory, slot, FIELDS_DIRECTORY, name + ".npy")
+
+    def _agent(self):
+        """
+        :return: DeepQAgent - the agent given, else the one the controller has now, which may be set after the
+                 checkpointer was created
+        """
+        if self.agent is not None:
+            return self.agent
+        return getattr(self.controller, "agent", None)
+
+    def latest(self):
+        """
+        :return: string - the slot of the most recent complete checkpoint, None if there is none
+        """
+        slots = [slot for slot in SLOTS if os.path.exists(self._path(slot, META_FILE))]
+        if len(slots) == 0:
+            return None
+        return max(slots, key=lambda slot: self._read_meta(slot)["observation_number"])
+
+    def step(self):
+        """
+        called once per env step, takes a checkpoint every interval steps
+        """
+        self.steps += 1
+        if self.steps % self.interval == 0:
+            self.checkpoint()
+
+    def _preserve_frame(self, frame_id):
+        """
+        frame observer of the store, called under its lock before a frame is overwritten
+        """
+        if frame_id in self.pending_frames:
+            self.preserved_frames[frame_id] = self.experience_store.frames[frame_id].copy()
+            self.pending_frames.discard(frame_id)
+
+    def checkpoint(self):
+        """
+        takes a checkpoint and starts writing it in the background
+        :return: bool - False if no checkpoint was taken because the previous one is still being written
+        """
+        if self.writer is not None and self.writer.is_alive():
+            return False
+        store = self.experience_store
+        if not store.allocated:
+            return False
+        slot = self.next_slot
+        frames_file = self._path(slot, FRAMES_FILE)
+        if not os.path.exists(frames_file) or np.load(frames_file, mmap_mode="r").shape != store.frames.shape or \
+                not os.path.exists(self._field_path(slot, "observation_numbers")):
+            self.written[slot] = 0
+        layouts = {name: (getattr(store, name).shape, getattr(store, name).dtype) for name in ROW_FIELDS}
+        with store.lock:
+            stored = len(store)
+            new_ids = np.flatnonzero(store.observation_numbers[:stored] >= self.written[slot])
+            rows = {name: getattr(store, name)[new_ids] for name in ROW_FIELDS}
+            novelty_scores = store.novelty_scores[:stored].copy()
+            novelty_state = {key: np.array(value) for key, value in store.novelty_estimator.get_state().items()}
+            observation_number = store.observation_number
+            frames_shape = store.frames.shape
+            self.pending_frames = set(np.concatenate([rows[name] for name in FRAME_FIELDS.keys()]).tolist())
+            self.preserved_frames = {}
+            store.frame_observer = self._preserve_frame
+
+        meta = {"observation_number": observation_number, "memory_size": store.memory_size,
+                "env_timestep": getattr(self.env, "timestep", None)}
+        controller_state = self.controller.get_checkpoint_state() if self.controller is not None else None
+        agent = self._agent()
+        agent_weights = agent.get_weights() if agent is not None else None
+        fields = (layouts, new_ids, rows, novelty_scores)
+        self.writer = threading.Thread(target=self._write,
+                                       args=(slot, frames_shape, fields, novelty_state, controller_state,
+                                             agent_weights, meta))
+        self.writer.start()
+        return True
+
+    def _write(self, slot, frames_shape, fields, novelty_state, controller_state, agent_weights, meta):
+        store = self.experience_store
+        os.makedirs(os.path.join(self.directory, slot), exist_ok=True)
+        if os.path.exists(self._path(slot, META_FILE)):
+            os.remove(self._path(slot, META_FILE))
+
+        frames_file = self._path(slot, FRAMES_FILE)
+        if self.written[slot] > 0:
+            frames = np.load(frames_file, mmap_mode="r+")
+        else:
+            frames = np.lib.format.open_memmap(frames_file, mode="w+", dtype=np.uint8, shape=frames_shape)
+        staging = np.empty((FRAME_CHUNK,) + frames_shape[1:], dtype=np.uint8)
+        frame_ids = sorted(self.pending_frames)
+        for start in range(0, len(frame_ids), FRAME_CHUNK):
+            # frames are copied under the lock a chunk at a time, and written to disk outside it
+            with store.lock:
+                chunk = [frame_id for frame_id in frame_ids[start:start + FRAME_CHUNK]
+                         if frame_id in self.pending_frames]
+                for k, frame_id in enumerate(chunk):
+                    staging[k] = store.frames[frame_id]
+                    self.pending_frames.discard(frame_id)
+            for k, frame_id in enumerate(chunk):
+                frames[frame_id] = staging[k]
+        with store.lock:
+            store.frame_observer = None
+            preserved_frames = self.preserved_frames
+            self.preserved_frames = {}
+        for frame_id, frame in preserved_frames.items():
+            frames[frame_id] = frame
+        frames.flush()
+        del frames
+
+        self._write_fields(slot, *fields)
+        np.savez(self._path(slot, NOVELTY_FILE), **novelty_state)
+        if controller_state is not None:
+            np.savez(self._path(slot, CONTROLLER_FILE), **controller_state)
+        if agent_weights is not None:
+            np.savez(self._path(slot, AGENT_FILE), *agent_weights)
+        tmp_file = self._path(slot, META_FILE + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, self._path(slot, META_FILE))
+
+        self.written[slot] = meta["observation_number"]
+        self.next_slot = SLOTS[1 - SLOTS.index(slot)]
+
+    def _write_fields(self, slot, layouts, new_ids, rows, novelty_scores):
+        """
+        writes the new rows to the field files of the slot, created with the layout of the store fields if the slot
+        is written from scratch
+        """
+        os.makedirs(os.path.join(self.directory, slot, FIELDS_DIRECTORY), exist_ok=True)
+        for name, (shape, dtype) in layouts.items():
+            if self.written[slot] > 0:
+                array = np.load(self._field_path(slot, name), mmap_mode="r+")
+            else:
+                array = np.lib.format.open_memmap(self._field_path(slot, name), mode="w+", dtype=dtype, shape=shape)
+            array[new_ids] = rows[name]
+            if name == "novelty_scores":
+                array[:len(novelty_scores)] = novelty_scores
+            array.flush()
+            del array
+
+    def wait(self):
+        """
+        waits for the checkpoint being written, if any
+        """
+        if self.writer is not None:
+            self.writer.join()
+
+    def restore(self):
+        """
+        restores the store, controller, agent and env from the latest complete checkpoint. The env timestep is
+        restored in place, so this must be called after env.reset()
+        :return: bool - False if there is no checkpoint to restore
+        """
+        slot = self.latest()
+        if slot is None:
+            return False
+        meta = self._read_meta(slot)
+        fields = {name: np.load(self._field_path(slot, name), mmap_mode="r") for name in ROW_FIELDS}
+        with np.load(self._path(slot, NOVELTY_FILE)) as novelty:
+            self.experience_store.restore(fields, np.load(self._path(slot, FRAMES_FILE), mmap_mode="r"),
+                                          meta["observation_number"], dict(novelty))
+        # the agent first, so that the controller restarts its learner from the restored weights
+        agent = self._agent()
+        if agent is not None and os.path.exists(self._path(slot, AGENT_FILE)):
+            with np.load(self._path(slot, AGENT_FILE)) as weights:
+                agent.set_weights([weights["arr_%d" % i] for i in range(len(weights.files))])
+        if self.controller is not None and os.path.exists(self._path(slot, CONTROLLER_FILE)):
+            with np.load(self._path(slot, CONTROLLER_FILE)) as controller_state:
+                self.controller.set_checkpoint_state(dict(controller_state))
+        if self.env is not None and meta["env_timestep"] is not None:
+            self.env.timestep = meta["env_timestep"]
+        return True
@@ -0,0 +1,95 @@
+import numpy as np
+
+
+class FrameEmbedder:
+    """
+    Maps frames to small float32 vectors: the frame is subsampled taking one pixel every downsample pixels on both
+    axes, normalized to [0, 1] and, if dim is set, reduced by a fixed gaussian random projection (which preserves
+    distances in expectation). The mse between two embeddings approximates the mse between the two frames.
+    """
+    def __init__(self, downsample=8, dim=64, seed=0):
+        """
+        :param downsample: int - the subsampling step of the rows and columns of the frames
+        :param dim: int - the size of the projected embeddings, None to keep the subsampled pixels
+        :param seed: int - the seed of the random projection
+        """
+        self.downsample = downsample
+        self.dim = dim
+        self.seed = seed
+        self.projection = None
+
+    def __call__(self, retinas):
+        """
+        :param retinas: ndarray - a uint8 frame, or a batch of frames
+        :return: ndarray - the float32 embedding, or a (batch, dim) array of embeddings
+        """
+        retinas = np.asarray(retinas)
+        single = retinas.ndim == 3
+        if single:
+            retinas = retinas[None]
+        pixels = retinas[:, ::self.downsample, ::self.downsample].reshape(len(retinas), -1)
+        embeddings = pixels.astype(np.float32)
+        embeddings *= 1/255
+        if self.dim is not None:
+            if self.projection is None:
+                rng = np.random.RandomState(self.seed)
+                self.projection = (rng.randn(pixels.shape[1], self.dim)/np.sqrt(self.dim)).astype(np.float32)
+            # scaled so that the mse of the projections matches the mse of the pixels
+            embeddings = embeddings.dot(self.projection)*np.float32(np.sqrt(self.dim/pixels.shape[1]))
+        return embeddings[0] if single else embeddings
+
+    def embed_goal(self, goal):
+        """
+        :param goal: Goal - its embedding is computed once and cached on it
+        :return: ndarray - the embedding of the goal retina
+        """
+        if goal.embedding is None:
+            goal.embedding = self(goal.retina)
+        return goal.embedding
+
+
+class EmbeddingIndex:
+    """
+    A fixed number of embeddings in a contiguous float32 matrix, with batched brute-force k-nearest-neighbour
+    queries. Distances are mean squared differences, like mse.
+    """
+    def __init__(self, capacity, dim):
+        """
+        :param capacity: int - the number of rows
+        :param dim: int - the size of the embeddings
+        """
+        self.capacity = capacity
+        self.dim = dim
+        self.embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self.squared_norms = np.zeros(capacity, dtype=np.float32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def set(self, idx, embedding):
+        """
+        :param idx: int - the row, rows must be filled in order from 0
+        :param embedding: ndarray - the new embedding of the row
+        """
+        self.embeddings[idx] = embedding
+        self.squared_norms[idx] = np.dot(self.embeddings[idx], self.embeddings[idx])
+        self.size = max(self.size, idx + 1)
+
+    def knn(self, queries, k):
+        """
+        :param queries: ndarray - a (batch, dim) array of embeddings
+        :param k: int - the number of neighbours, at most len(self)
+        :return: (ndarray, ndarray) - the (batch, k) distances and rows of the nearest neighbours, closest first
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        embeddings = self.embeddings[:self.size]
+        distances = self.squared_norms[:self.size] - 2*queries.dot(embeddings.T)
+        distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+        k = min(k, self.size)
+        rows = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest = np.take_along_axis(distances, rows, axis=1)
+        order = np.argsort(nearest, axis=1)
+        rows = np.take_along_axis(rows, order, axis=1)
+        nearest = np.maximum(np.take_along_axis(nearest, order, axis=1), 0)/self.dim
+        return nearest, rows
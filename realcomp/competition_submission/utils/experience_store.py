@@ -1,11 +1,16 @@
+import threading
+
 import numpy as np
 
 from competition_submission.consts import JOINT_POSITIONS, TOUCH_SENSORS, RETINA, GOAL
-from competition_submission.utils.helper_functions import mse, initialize_array
+from competition_submission.utils.frame_codec import CompressedFrameTable
+from competition_submission.utils.helper_functions import batch_mse
+from competition_submission.utils.novelty import NoveltyEstimator
+from competition_submission.utils.sum_tree import SumTree
 
 INITIAL_PREFIX = "initial_%s"
 RESULT_PREFIX = "result_%s"
-OBSERVATION_NUMBER = "observation_number" 
+OBSERVATION_NUMBER = "observation_number"
 NOVELTY_SCORE = "novelty_score"
 INITIAL_JOINT_POSITIONS = INITIAL_PREFIX % JOINT_POSITIONS
 INITIAL_TOUCH_SENSORS = INITIAL_PREFIX % TOUCH_SENSORS
@@ -15,139 +20,466 @@ RESULT_JOINT_POSITIONS = RESULT_PREFIX % JOINT_POSITIONS
 RESULT_TOUCH_SENSORS = RESULT_PREFIX % TOUCH_SENSORS
 RESULT_RETINA = RESULT_PREFIX % RETINA
 
-
-class Experience:
-    def __init__(self,
-                 observation_number,
-                 novelty_score,
-                 initial_joint_positions,
-                 initial_touch_sensors,
-                 initial_retina,
-                 action,
-                 result_joint_positions,
-                 result_touch_sensors,
-                 result_retina,
-                 goal,
-                 reward_strategy):
-        assert isinstance(goal, Goal)
-        self.observation_number = observation_number
-        self.novelty_score = novelty_score
-        self.initial_joint_positions = initial_joint_positions
-        self.initial_touch_sensors = initial_touch_sensors
-        self.initial_retina = initial_retina
-        self.action = action
-        self.result_joint_positions = result_joint_positions
-        self.result_touch_sensors = result_touch_sensors
-        self.result_retina = result_retina
-        self.goal = goal
-        self.reward = reward_strategy(self.result_retina, self.goal.retina)
+# per-experience arrays of the store: name -> dtype
+STATE_FIELDS = {
+    "initial_joint_positions": np.float32,
+    "initial_touch_sensors": np.float32,
+    "actions": np.float32,
+    "result_joint_positions": np.float32,
+    "result_touch_sensors": np.float32,
+    "goal_joint_positions": np.float32,
+    "goal_touch_sensors": np.float32,
+}
+SCALAR_FIELDS = {
+    "observation_numbers": np.int64,
+    "novelty_scores": np.float64,
+    "rewards": np.float32,
+    "initial_frame_ids": np.int64,
+    "result_frame_ids": np.int64,
+    "goal_frame_ids": np.int64,
+}
+# frames are kept once in a frame table and referred to by index: frame id field -> batch field
+FRAME_FIELDS = {
+    "initial_frame_ids": "initial_retinas",
+    "result_frame_ids": "result_retinas",
+    "goal_frame_ids": "goal_retinas",
+}
+FRAMES = "frames"
+# rows of the frame table when it is allocated, it doubles whenever it is full
+INITIAL_FRAMES = 1024
+FIELDS = list(STATE_FIELDS.keys()) + list(SCALAR_FIELDS.keys()) + list(FRAME_FIELDS.values())
 
 
 class ExperienceBatch:
-    def __init__(self, batch_size=None, experience_list=None):
-        assert batch_size is not None or experience_list is not None
-        if batch_size is not None and experience_list is not None:
-            assert len(experience_list) == batch_size
-        elif batch_size is None:
-            batch_size = len(experience_list)
-
-        self.observation_numbers = initialize_array(batch_size)
-        self.novelty_scores = initialize_array(batch_size)
-        self.initial_joint_positions = initialize_array(batch_size)
-        self.initial_touch_sensors = initialize_array(batch_size)
-        self.initial_retinas = initialize_array(batch_size)
-        self.actions = initialize_array(batch_size)
-        self.result_joint_positions = initialize_array(batch_size)
-        self.result_touch_sensors = initialize_array(batch_size)
-        self.result_retinas = initialize_array(batch_size)
-        self.goal_retinas = initialize_array(batch_size)
-        self.goal_joint_positions = initialize_array(batch_size)
-        self.goal_touch_sensors = initialize_array(batch_size)
-        self.rewards = initialize_array(batch_size)
-        self.batch_size = batch_size
-        self.populated_size = 0
-
-        if experience_list is not None:
-            for i in range(batch_size):
-                self.add_experience_to_batch(experience_list[i])
-
-    def add_experience_to_batch(self, experience):
-        assert isinstance(experience, Experience)
-        self.populated_size += 1
-        try:
-            self.observation_numbers[self.populated_size] = experience.observation_number
-            self.novelty_scores[self.populated_size] = experience.novelty_score
-            self.initial_joint_positions[self.populated_size] = experience.initial_joint_positions
-            self.initial_touch_sensors[self.populated_size] = experience.initial_touch_sensors
-            self.initial_retinas[self.populated_size] = experience.initial_retina
-            self.actions[self.populated_size] = experience.action
-            self.result_joint_positions[self.populated_size] = experience.result_joint_positions
-            self.result_touch_sensors[self.populated_size] = experience.result_touch_sensors
-            self.result_retinas[self.populated_size] = experience.result_retina
-            self.goal_joint_positions[self.populated_size] = experience.goal.joint_positions
-            self.goal_retinas[self.populated_size] = experience.goal.retina
-            self.goal_touch_sensors[self.populated_size] = experience.goal.touch_sensors
-        except Exception:
-            self.populated_size -= 1
+    """
+    A batch of experiences as contiguous arrays, one per field of the store, with the batch on the first axis
+    """
+    def __init__(self, **arrays):
+        """
+        :param arrays: ndarray - one array per name in FIELDS, all with the same first dimension
+        """
+        for name in FIELDS:
+            setattr(self, name, arrays[name])
+        self.batch_size = len(self.observation_numbers)
+        self.populated_size = self.batch_size
 
 
 class Goal:
-    def __init__(self, retina, joint_positions, touch_sensors):
+    def __init__(self, retina, joint_positions, touch_sensors, frame_id=None):
         self.retina = retina
         self.joint_positions = joint_positions
         self.touch_sensors = touch_sensors
-
-    @staticmethod
-    def from_experience(experience):
-        assert isinstance(experience, Experience)
-        return Goal(experience.result_retina, experience.result_joint_positions, experience.result_touch_sensors)
+        # the index of the retina in the frame table of the store the goal was taken from, if any
+        self.frame_id = frame_id
+        # the embedding of the retina, set by FrameEmbedder.embed_goal
+        self.embedding = None
 
 
 class ExperienceStore:
-    def __init__(self, memory_size):
+    """
+    A ring buffer of experiences kept as a structure of preallocated arrays: frames are stored as uint8, joints,
+    touch sensors and actions as float32. The arrays are allocated on the first insert, when the shapes of the
+    observations are known.
+
+    Each frame is stored once in a reference counted frame table: the initial frame of an experience is the result
+    frame of the one before, and all the experiences pursuing a goal share its frame. A frame is freed when the last
+    experience referring to it is evicted. The store also holds a reference on the frame of the current goal.
+
+    The frame table starts with INITIAL_FRAMES rows and doubles when it is full, up to max_frames rows, which it can
+    never exceed: about 1.2 frames per experience are used in practice.
+
+    The novelty scores are mirrored in a sum tree, so that goals are drawn proportionally to their novelty in
+    O(log N).
+
+    Inserts, goal selection and batch gathering hold self.lock, so batches can be gathered by another thread. Frames
+    of a batch being gathered outside the lock are pinned, which takes up to reserved_frames extra rows in the table.
+
+    With a frame codec the frame table is kept compressed, and the frames of a batch are decoded in parallel.
+    The reward of an experience is the mse between its result and goal frames normalized to [0, 1], or between
+    their embeddings with an embedder. Replay batches can be relabeled in hindsight with goals achieved later in the
+    same trajectory, their rewards are then recomputed for the whole batch at once.
+    """
+    def __init__(self, memory_size, novelty_estimator=None, reserved_frames=0, frame_codec=None, embedder=None):
+        """
+        :param memory_size: int - the number of experiences of the ring buffer
+        :param novelty_estimator: NoveltyEstimator - scores the frames on insert and goal selection, a full
+                                  resolution one if None
+        :param reserved_frames: int - extra rows of the frame table for the frames pinned by batch samplers
+        :param frame_codec: ZlibFrameCodec - compresses the frames of the table, None to keep them as uint8 arrays
+        :param embedder: FrameEmbedder - maps frames to the embeddings the rewards are computed on, None to compute
+                         them on the full frames
+        """
         self.observation_number = 0
         self.memory_size = memory_size
-        self.memory_store = [None] * self.memory_size
         self.novelty_decay = 0.5
-        self.image_total = None
+        self.novelty_estimator = novelty_estimator if novelty_estimator is not None else NoveltyEstimator()
+        self.allocated = False
+        self.goal = None
+        self.last_frame_id = None
+        self.priorities = SumTree(memory_size)
+        self.reserved_frames = reserved_frames
+        self.frame_codec = frame_codec
+        self.embedder = embedder
+        # three frames per experience, the new one being inserted, the current and next goals and the pinned frames
+        self.max_frames = 3*memory_size + 3 + reserved_frames
+        self.lock = threading.Lock()
+        # called under the lock with the id of every frame about to be overwritten, see Checkpointer
+        self.frame_observer = None
+
+    def __len__(self):
+        return min(self.observation_number, self.memory_size)
+
+    def _allocate_array(self, name, shape, dtype):
+        """
+        allocates the array of a field, zeroed pages are only committed when first written
+        :param name: string - the name of the field
+        :param shape: tuple - the shape of the array, memory_size first
+        :param dtype: the numpy dtype of the array
+        :return: ndarray
+        """
+        return np.zeros(shape, dtype=dtype)
+
+    def _allocate(self, previous_observation, action):
+        shapes = {
+            "initial_joint_positions": np.shape(previous_observation[JOINT_POSITIONS]),
+            "initial_touch_sensors": np.shape(previous_observation[TOUCH_SENSORS]),
+            "actions": np.shape(action),
+        }
+        for prefix in ["result", "goal"]:
+            shapes["%s_joint_positions" % prefix] = shapes["initial_joint_positions"]
+            shapes["%s_touch_sensors" % prefix] = shapes["initial_touch_sensors"]
+        self._allocate_fields(shapes, np.shape(previous_observation[RETINA]))
+
+    def _allocate_fields(self, shapes, frame_shape, frame_rows=None):
+        """
+        :param shapes: dict - the shape of one experience of each state field
+        :param frame_shape: tuple - the shape of a frame
+        :param frame_rows: int - the initial number of rows of the frame table, INITIAL_FRAMES if None
+        """
+        for name, dtype in STATE_FIELDS.items():
+            setattr(self, name, self._allocate_array(name, (self.memory_size,) + shapes[name], dtype))
+        for name, dtype in SCALAR_FIELDS.items():
+            setattr(self, name, self._allocate_array(name, (self.memory_size,), dtype))
+        if frame_rows is None:
+            frame_rows = min(INITIAL_FRAMES, self.max_frames)
+        # the table replaced by a restore stops its decoding threads
+        self._close_frames()
+        if self.frame_codec is not None:
+            self.frames = CompressedFrameTable(frame_rows, frame_shape, self.frame_codec)
+        else:
+            self.frames = self._allocate_array(FRAMES, (frame_rows,) + tuple(frame_shape), np.uint8)
+        self.frame_references = np.zeros(len(self.frames), dtype=np.int32)
+        self.free_frames = list(range(len(self.frames) - 1, -1, -1))
+        self.allocated = True
+
+    def _close_frames(self):
+        if isinstance(getattr(self, FRAMES, None), CompressedFrameTable):
+            self.frames.close()
+
+    def close(self):
+        """
+        stops the decoding threads of a compressed frame table, the store can not be sampled afterwards
+        """
+        self._close_frames()
+
+    def _resize_frames(self, rows):
+        """
+        :param rows: int - the new number of rows of the frame table
+        :return: ndarray - a frame table of rows rows holding the frames of the current one at the same ids
+        """
+        frames = self._allocate_array(FRAMES, (rows,) + self.frames.shape[1:], np.uint8)
+        frames[:len(self.frames)] = self.frames
+        return frames
+
+    def _grow_frames(self, rows=None):
+        """
+        grows the frame table, called under the lock. Views of the frames taken before, such as goal retinas, keep
+        referring to the old table, whose frames are not written anymore
+        :param rows: int - the new number of rows, twice the current one (at most max_frames) if None
+        """
+        old_rows = len(self.frames)
+        if rows is None:
+            rows = min(2*old_rows, self.max_frames)
+        if rows <= old_rows:
+            raise RuntimeError("the frame table is full at %d frames" % old_rows)
+        if self.frame_codec is not None:
+            self.frames.grow(rows)
+        else:
+            self.frames = self._resize_frames(rows)
+        self.frame_references = np.concatenate([self.frame_references,
+                                                np.zeros(rows - old_rows, dtype=self.frame_references.dtype)])
+        # the new rows are taken once the frames freed so far are reused
+        self.free_frames[:0] = range(rows - 1, old_rows - 1, -1)
+
+    def _rebuild_frame_references(self):
+        """
+        recounts the references of the frame table from the stored experiences
+        """
+        self.frame_references = np.zeros(len(self.frames), dtype=np.int32)
+        for name in FRAME_FIELDS.keys():
+            np.add.at(self.frame_references, getattr(self, name)[:len(self)], 1)
+        self.free_frames = list(np.flatnonzero(self.frame_references == 0)[::-1])
+        self.goal = None
+        self.last_frame_id = None
+
+    def _rebuild_priorities(self):
+        self.priorities.build(self.novelty_scores[:len(self)])
+
+    def restore(self, arrays, frames, observation_number, novelty_state):
+        """
+        replaces the content of the store, e.g. with a checkpoint
+        :param arrays: dict - an array per name of STATE_FIELDS and SCALAR_FIELDS, memory_size first
+        :param frames: ndarray - a frame table holding at least the frames referred to by the experiences
+        :param observation_number: int - the number of experiences inserted so far
+        :param novelty_state: dict - the state of the novelty estimator, as returned by its get_state
+        """
+        with self.lock:
+            self._allocate_fields({name: arrays[name].shape[1:] for name in STATE_FIELDS.keys()}, frames.shape[1:])
+            if len(frames) > self.max_frames:
+                raise ValueError("the frame table to restore has %d frames, more than %d"
+                                 % (len(frames), self.max_frames))
+            if len(frames) > len(self.frames):
+                self._grow_frames(len(frames))
+            for name in list(STATE_FIELDS.keys()) + list(SCALAR_FIELDS.keys()):
+                getattr(self, name)[:] = arrays[name]
+            self.observation_number = observation_number
+            self._rebuild_frame_references()
+            for frame_id in np.flatnonzero(self.frame_references):
+                self.frames[frame_id] = frames[frame_id]
+            self.novelty_estimator.set_state(novelty_state)
+            self._rebuild_priorities()
+
+    def set_novelty_score(self, memory_id, novelty_score):
+        """
+        :param memory_id: int - a slot of the ring buffer
+        :param novelty_score: float - the new novelty score of the experience, and its goal priority
+        """
+        self.novelty_scores[memory_id] = novelty_score
+        self.priorities.update(memory_id, novelty_score)
+
+    def _add_frame(self, retina):
+        if len(self.free_frames) == 0:
+            self._grow_frames()
+        frame_id = self.free_frames.pop()
+        if self.frame_observer is not None:
+            self.frame_observer(frame_id)
+        self.frames[frame_id] = retina
+        self.frame_references[frame_id] = 1
+        return frame_id
+
+    def _acquire_frame(self, frame_id):
+        self.frame_references[frame_id] += 1
+        return frame_id
+
+    def _release_frame(self, frame_id):
+        self.frame_references[frame_id] -= 1
+        if self.frame_references[frame_id] == 0:
+            self.free_frames.append(frame_id)
+
+    def _set_goal(self, goal):
+        """
+        makes goal the current goal, its frame is added to the table unless it was taken from it or is the same as
+        the frame of the current goal
+        """
+        if goal is self.goal:
+            return
+        if goal.frame_id is None and self.goal is not None and \
+                np.array_equal(self.frames[self.goal.frame_id], goal.retina):
+            goal.frame_id = self._acquire_frame(self.goal.frame_id)
+        elif goal.frame_id is None:
+            goal.frame_id = self._add_frame(goal.retina)
+        else:
+            self._acquire_frame(goal.frame_id)
+        if self.goal is not None:
+            self._release_frame(self.goal.frame_id)
+        self.goal = goal
 
     def insert_observation(self, previous_observation, current_observation, goal, action):
-        normalized_image = current_observation[RETINA].astype(np.float)/255
-        if self.image_total is None:
-            self.image_total = np.zeros_like(current_observation[RETINA], dtype=np.float)
-        self.image_total += normalized_image
-        mse_score = mse(self.image_total/(self.observation_number + 1), normalized_image)
-        self.memory_store[self.observation_number % self.memory_size] = Experience(
-            observation_number=self.observation_number,
-            novelty_score=mse_score,
-            initial_joint_positions=np.asarray(previous_observation[JOINT_POSITIONS]),
-            initial_touch_sensors=np.asarray(previous_observation[TOUCH_SENSORS]),
-            initial_retina=np.asarray(previous_observation[RETINA]),
-            action=np.asarray(action),
-            result_joint_positions=np.asarray(current_observation[JOINT_POSITIONS]),
-            result_touch_sensors=np.asarray(current_observation[TOUCH_SENSORS]),
-            result_retina=np.asarray(current_observation[RETINA]),
-            goal=goal,
-            reward_strategy=mse
-        )
-        self.observation_number += 1
+        with self.lock:
+            if not self.allocated:
+                self._allocate(previous_observation, action)
+            mse_score = self.novelty_estimator.insert(current_observation[RETINA])
+
+            self._set_goal(goal)
+            # the initial frame is usually the result frame of the previous experience
+            if self.last_frame_id is not None and np.array_equal(self.frames[self.last_frame_id],
+                                                                 previous_observation[RETINA]):
+                initial_frame_id = self._acquire_frame(self.last_frame_id)
+            else:
+                initial_frame_id = self._add_frame(previous_observation[RETINA])
+            result_frame_id = self._add_frame(current_observation[RETINA])
+            goal_frame_id = self._acquire_frame(goal.frame_id)
+
+            idx = self.observation_number % self.memory_size
+            if self.observation_number >= self.memory_size:
+                for name in FRAME_FIELDS.keys():
+                    self._release_frame(getattr(self, name)[idx])
+            if self.embedder is not None:
+                reward = self.compute_rewards(current_observation[RETINA][None],
+                                              goal_embeddings=self.embedder.embed_goal(goal)[None])[0]
+            else:
+                reward = self.compute_rewards(current_observation[RETINA][None], goal.retina[None])[0]
+            self._write_row(idx, {
+                "initial_frame_ids": initial_frame_id,
+                "result_frame_ids": result_frame_id,
+                "goal_frame_ids": goal_frame_id,
+                "novelty_scores": mse_score,
+                "initial_joint_positions": previous_observation[JOINT_POSITIONS],
+                "initial_touch_sensors": previous_observation[TOUCH_SENSORS],
+                "actions": action,
+                "result_joint_positions": current_observation[JOINT_POSITIONS],
+                "result_touch_sensors": current_observation[TOUCH_SENSORS],
+                # goals set from a bare image carry no joint and touch state
+                "goal_joint_positions": np.nan if goal.joint_positions is None else goal.joint_positions,
+                "goal_touch_sensors": np.nan if goal.touch_sensors is None else goal.touch_sensors,
+                "rewards": reward,
+                "observation_numbers": self.observation_number,
+            })
+            self.priorities.update(idx, mse_score)
+            self.last_frame_id = result_frame_id
+            self.observation_number += 1
+
+    def _write_row(self, idx, row):
+        """
+        writes an experience to a slot of the ring buffer
+        :param idx: int - the slot
+        :param row: dict - the value of each field of STATE_FIELDS and SCALAR_FIELDS
+        """
+        for name, value in row.items():
+            getattr(self, name)[idx] = value
+
+    def get_goal(self, memory_id):
+        """
+        :param memory_id: int - a slot of the ring buffer
+        :return: Goal - the result state of the experience, its retina is a view of the frame table that stays
+                 valid while the goal is the current one of the store
+        """
+        frame_id = self.result_frame_ids[memory_id]
+        return Goal(self.frames[frame_id],
+                    self.result_joint_positions[memory_id].copy(),
+                    self.result_touch_sensors[memory_id].copy(),
+                    frame_id=frame_id)
 
     def select_new_goal(self):
+        with self.lock:
+            if self.priorities.total() > 0:
+                selected_memory_id = int(self.priorities.sample())
+            else:
+                selected_memory_id = np.random.randint(len(self))
+            new_goal = self.get_goal(selected_memory_id)
+            modified_novelty_score_for_selected_memory = self.novelty_estimator.score(new_goal.retina)
+            self.set_novelty_score(selected_memory_id, modified_novelty_score_for_selected_memory)
+            self._set_goal(new_goal)
+            return new_goal
+
+    def get_batch(self, memory_ids):
+        """
+        gathers experiences into contiguous arrays
+        :param memory_ids: ndarray - slots of the ring buffer
+        :return: ExperienceBatch
+        """
+        with self.lock:
+            arrays = {name: getattr(self, name)[memory_ids] for name in STATE_FIELDS.keys()}
+            arrays.update({name: getattr(self, name)[memory_ids] for name in SCALAR_FIELDS.keys()})
+            for frame_ids, retinas in FRAME_FIELDS.items():
+                arrays[retinas] = self.frames[arrays[frame_ids]]
+        return ExperienceBatch(**arrays)
+
+    def allocate_batch(self, batch_size):
+        """
+        :param batch_size: int - the number of experiences
+        :return: ExperienceBatch - a zeroed batch to be filled by fill_batch
+        """
+        arrays = {name: np.zeros((batch_size,) + getattr(self, name).shape[1:], dtype=dtype)
+                  for name, dtype in list(STATE_FIELDS.items()) + list(SCALAR_FIELDS.items())}
+        for retinas in FRAME_FIELDS.values():
+            arrays[retinas] = np.zeros((batch_size,) + self.frames.shape[1:], dtype=np.uint8)
+        return ExperienceBatch(**arrays)
+
+    def fill_batch(self, memory_ids, batch):
+        """
+        gathers experiences into the arrays of a preallocated batch. Only the small fields are copied while holding
+        the lock, the frames are pinned and copied outside it so that inserts are not held up
+        :param memory_ids: ndarray - slots of the ring buffer, as many as the batch size
+        :param batch: ExperienceBatch - a batch returned by allocate_batch
+        """
+        with self.lock:
+            for name in list(STATE_FIELDS.keys()) + list(SCALAR_FIELDS.keys()):
+                np.take(getattr(self, name), memory_ids, axis=0, out=getattr(batch, name))
+            pinned_frames = np.concatenate([getattr(batch, name) for name in FRAME_FIELDS.keys()])
+            np.add.at(self.frame_references, pinned_frames, 1)
+        for frame_ids, retinas in FRAME_FIELDS.items():
+            np.take(self.frames, getattr(batch, frame_ids), axis=0, out=getattr(batch, retinas))
+        with self.lock:
+            np.subtract.at(self.frame_references, pinned_frames, 1)
+            pinned_frames = np.unique(pinned_frames)
+            self.free_frames.extend(pinned_frames[self.frame_references[pinned_frames] == 0])
+
+    def sample_memory_ids(self, batch_size, prioritized=False):
+        """
+        samples slots of the ring buffer, the last one is always the latest experience
+        :param batch_size: int - the number of slots
+        :param prioritized: bool - sample proportionally to the novelty scores instead of uniformly
+        :return: ndarray
+        """
+        if prioritized and self.priorities.total() > 0:
+            chosen_ids = self.priorities.sample(batch_size-1)
+        else:
+            chosen_ids = np.random\
+                .choice(len(self), size=batch_size-1)
+        return np.concatenate((chosen_ids, [(self.observation_number - 1) % self.memory_size]), axis=0)
+
+    def compute_rewards(self, result_retinas, goal_retinas=None, goal_embeddings=None):
+        """
+        :param result_retinas: ndarray - a batch of uint8 result frames
+        :param goal_retinas: ndarray - a batch of uint8 goal frames
+        :param goal_embeddings: ndarray - the embeddings of the goal frames, used instead of goal_retinas if given
+        :return: ndarray - the reward of each experience
+        """
+        if self.embedder is not None:
+            if goal_embeddings is None:
+                goal_embeddings = self.embedder(goal_retinas)
+            return batch_mse(self.embedder(result_retinas), goal_embeddings)
+        return batch_mse(result_retinas.astype(np.float32), goal_retinas.astype(np.float32))/255**2
+
+    def relabel_batch(self, batch, memory_ids, probability, horizon):
+        """
+        replaces, with a given probability, the goal of each experience by the result of an experience up to
+        horizon steps later pursuing the same goal (the experience itself if that one was evicted or pursued another
+        goal), then recomputes the rewards of the batch
+        :param batch: ExperienceBatch - the batch of the experiences in memory_ids, relabeled in place
+        :param memory_ids: ndarray - the slots of the experiences of the batch
+        :param probability: float - the fraction of relabeled experiences
+        :param horizon: int - the maximum number of steps between an experience and its new goal
+        """
+        with self.lock:
+            relabeled = np.flatnonzero(np.random.uniform(size=len(memory_ids)) < probability)
+            ids = memory_ids[relabeled]
+            observation_numbers = self.observation_numbers[ids]
+            offsets = np.random.randint(0, horizon + 1, size=len(ids))
+            offsets = np.minimum(offsets, self.observation_number - 1 - observation_numbers)
+            future_ids = (ids + offsets) % self.memory_size
+            same_trajectory = (self.observation_numbers[future_ids] == observation_numbers + offsets) & \
+                (self.goal_frame_ids[future_ids] == self.goal_frame_ids[ids])
+            future_ids = np.where(same_trajectory, future_ids, ids)
+
+            batch.goal_frame_ids[relabeled] = self.result_frame_ids[future_ids]
+            batch.goal_joint_positions[relabeled] = self.result_joint_positions[future_ids]
+            batch.goal_touch_sensors[relabeled] = self.result_touch_sensors[future_ids]
+            batch.goal_retinas[relabeled] = self.frames[batch.goal_frame_ids[relabeled]]
+        batch.rewards[:] = self.compute_rewards(batch.result_retinas, batch.goal_retinas)
 
-        mse_scores = [memory.novelty_score for memory in self.memory_store if memory is not None]
-        normalized_mse_scores = np.asarray(mse_scores)/np.sum(mse_scores)
-        selected_memory_id = np.random.choice(min(self.observation_number, self.memory_size), p=normalized_mse_scores)
-        new_goal = Goal.from_experience(self.memory_store[selected_memory_id])
-        modified_novelty_score_for_selected_memory = mse(self.image_total/self.observation_number,
-                                                         new_goal.retina.astype(np.float)/255)
-        self.memory_store[selected_memory_id].novelty_score = modified_novelty_score_for_selected_memory
-        return new_goal
-
-    def get_memory_replay_batch(self, batch_size):
-        chosen_ids = np.random\
-            .choice(min(self.observation_number, self.memory_size), size=batch_size-1)
-        chosen_ids = np.concatenate((chosen_ids, [(self.observation_number - 1) % self.memory_size]), axis=0)
-        batch = ExperienceBatch(batch_size)
-        for chosen_id in chosen_ids:
-            batch.add_experience_to_batch(self.memory_store[chosen_id])
+    def get_memory_replay_batch(self, batch_size, prioritized=False, hindsight_probability=0.0, hindsight_horizon=50):
+        """
+        samples a batch of experiences, the last one is always the latest experience
+        :param batch_size: int - the number of experiences
+        :param prioritized: bool - sample proportionally to the novelty scores instead of uniformly
+        :param hindsight_probability: float - the fraction of experiences relabeled with a future goal
+        :param hindsight_horizon: int - the maximum number of steps between an experience and its future goal
+        :return: ExperienceBatch
+        """
+        memory_ids = self.sample_memory_ids(batch_size, prioritized)
+        batch = self.get_batch(memory_ids)
+        if hindsight_probability > 0:
+            self.relabel_batch(batch, memory_ids, hindsight_probability, hindsight_horizon)
         return batch
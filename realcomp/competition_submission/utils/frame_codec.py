@@ -0,0 +1,130 @@
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class ZlibFrameCodec:
+    """
+    Compresses uint8 frames with zlib. With delta set, frames are stored as their difference (modulo 256) from a
+    reference frame, the first one encoded: most of the tabletop does not change, so the differences are mostly
+    zeros and compress several times better, while every frame can still be decoded on its own.
+    """
+    def __init__(self, level=1, delta=True):
+        """
+        :param level: int - the zlib compression level, 1 is the fastest
+        :param delta: bool - encode the difference from the reference frame
+        """
+        self.level = level
+        self.delta = delta
+        self.reference = None
+
+    def encode(self, frame):
+        """
+        :param frame: ndarray - a uint8 frame
+        :return: bytes
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if self.delta:
+            if self.reference is None:
+                self.reference = frame.copy()
+            frame = frame - self.reference
+        return zlib.compress(frame, self.level)
+
+    def decode(self, data, out):
+        """
+        :param data: bytes - an encoded frame
+        :param out: ndarray - the uint8 array the frame is decoded into
+        """
+        frame = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(out.shape)
+        if self.delta:
+            np.add(frame, self.reference, out=out)
+        else:
+            np.copyto(out, frame)
+
+
+class CompressedFrameTable:
+    """
+    A table of frames kept compressed by a codec, used by ExperienceStore in place of its uint8 frame array.
+    It supports the indexing the store needs: setting a frame, getting one or an array of frames and np.take.
+    Frames of a batch are decoded in parallel by a thread pool (zlib releases the GIL), stopped by close().
+    """
+    def __init__(self, capacity, frame_shape, codec, workers=4):
+        """
+        :param capacity: int - the number of frames
+        :param frame_shape: tuple - the shape of a frame
+        :param codec: ZlibFrameCodec - encodes and decodes the frames
+        :param workers: int - the threads decoding the batches
+        """
+        self.shape = (capacity,) + tuple(frame_shape)
+        self.codec = codec
+        self.data = [None] * capacity
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # the last frame written, kept decoded: the store compares each new frame with it
+        self.last_id = None
+        self.last_frame = np.zeros(frame_shape, dtype=np.uint8)
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+        self.encode_seconds = 0.0
+        self.decoded_bytes = 0
+        self.decode_seconds = 0.0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __setitem__(self, frame_id, frame):
+        start = time.perf_counter()
+        data = self.codec.encode(frame)
+        self.encode_seconds += time.perf_counter() - start
+        self.raw_bytes += self.last_frame.nbytes
+        self.encoded_bytes += len(data)
+        self.data[frame_id] = data
+        self.last_id = frame_id
+        np.copyto(self.last_frame, frame)
+
+    def __getitem__(self, frame_ids):
+        if np.ndim(frame_ids) == 0:
+            if frame_ids == self.last_id:
+                return self.last_frame.copy()
+            out = np.empty(self.shape[1:], dtype=np.uint8)
+            self.codec.decode(self.data[frame_ids], out)
+            return out
+        return self.take(frame_ids)
+
+    def grow(self, capacity):
+        """
+        :param capacity: int - the new number of frames, the frames kept are unchanged
+        """
+        self.data.extend([None] * (capacity - len(self.data)))
+        self.shape = (capacity,) + self.shape[1:]
+
+    def take(self, indices, axis=0, out=None, mode="raise"):
+        """
+        decodes frames in parallel, as np.take(frames, indices, axis=0, out=out)
+        """
+        assert axis == 0
+        indices = np.asarray(indices)
+        if out is None:
+            out = np.empty(indices.shape + self.shape[1:], dtype=np.uint8)
+        start = time.perf_counter()
+        list(self.pool.map(lambda i: self.codec.decode(self.data[indices[i]], out[i]), range(len(indices))))
+        self.decode_seconds += time.perf_counter() - start
+        self.decoded_bytes += out.nbytes
+        return out
+
+    def report(self):
+        """
+        :return: dict - the compression ratio and the encode and decode throughputs in MB/s of raw frames
+        """
+        return {
+            "compression_ratio": self.raw_bytes/max(self.encoded_bytes, 1),
+            "encode_mb_per_s": self.raw_bytes/1e6/max(self.encode_seconds, 1e-9),
+            "decode_mb_per_s": self.decoded_bytes/1e6/max(self.decode_seconds, 1e-9),
+        }
+
+    def close(self):
+        """
+        stops the decoding threads, frames can not be taken afterwards
+        """
+        self.pool.shutdown()
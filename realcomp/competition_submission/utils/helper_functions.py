@@ -2,7 +2,23 @@ import numpy as np
 
 
 def mse(y, yh):
-    return np.square(y - yh).mean()
+    """
+    :param y: ndarray - an array, of any dtype
+    :param yh: ndarray - an array of the same shape
+    :return: float - the mean squared difference, computed in float64 so that uint8 frames do not wrap around
+    """
+    return np.square(np.asarray(y, dtype=np.float64) - np.asarray(yh, dtype=np.float64)).mean()
+
+
+def batch_mse(y, yh):
+    """
+    :param y: ndarray - a batch of arrays
+    :param yh: ndarray - a batch of arrays of the same shape
+    :return: ndarray - the mse of each pair of arrays along the first axis
+    """
+    dtype = np.result_type(y, yh, np.float32)
+    difference = (np.asarray(y, dtype=dtype) - np.asarray(yh, dtype=dtype)).reshape(len(y), -1)
+    return np.einsum("ij,ij->i", difference, difference)/difference.shape[1]
 
 
 def initialize_array(size):
@@ -0,0 +1,101 @@
+import threading
+
+
+class AsyncLearner:
+    """
+    Trains an agent in a background thread on batches of the experience store while the actor keeps stepping the
+    environment (tensorflow releases the GIL while it trains).
+
+    The learner trains its own copy of the agent and publishes its weights every publish_interval updates, the actor
+    picks them up in actor_step. The learner runs at most updates_per_step updates per actor step, and with
+    max_pending_updates set the actor waits when the learner falls more than that many updates behind.
+    """
+    def __init__(self, experience_store, learner_agent, batch_size, sampler=None, updates_per_step=0.25,
+                 publish_interval=100, max_pending_updates=None, hindsight_probability=0.0, hindsight_horizon=50):
+        """
+        :param experience_store: ExperienceStore - the store batches are sampled from
+        :param learner_agent: DeepQAgent - the agent trained by the learner, not the one used by the actor
+        :param batch_size: int - the number of experiences of a batch
+        :param sampler: PrefetchSampler - the sampler batches are taken from, the store is sampled directly if None
+        :param updates_per_step: float - the maximum number of training steps per actor step
+        :param publish_interval: int - the number of training steps between two weight publications
+        :param max_pending_updates: int - the number of allowed training steps the learner may lag behind before the
+                                    actor waits for it, None to never wait
+        :param hindsight_probability: float - as in ExperienceStore.get_memory_replay_batch, when sampling the store
+        :param hindsight_horizon: int - as in ExperienceStore.get_memory_replay_batch, when sampling the store
+        """
+        self.experience_store = experience_store
+        self.learner_agent = learner_agent
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.updates_per_step = updates_per_step
+        self.publish_interval = publish_interval
+        self.max_pending_updates = max_pending_updates
+        self.hindsight_probability = hindsight_probability
+        self.hindsight_horizon = hindsight_horizon
+        self.condition = threading.Condition()
+        self.actor_steps = 0
+        self.updates = 0
+        self.version = 0
+        self.actor_version = 0
+        self.published_weights = None
+        self.error = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _allowed_updates(self):
+        return int(self.actor_steps*self.updates_per_step)
+
+    def _can_update(self):
+        return self.updates < self._allowed_updates() and len(self.experience_store) > 0
+
+    def _run(self):
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.stopped or self._can_update())
+                    if self.stopped:
+                        break
+                if self.sampler is not None:
+                    batch = self.sampler.get_batch()
+                else:
+                    batch = self.experience_store.get_memory_replay_batch(
+                        self.batch_size, hindsight_probability=self.hindsight_probability,
+                        hindsight_horizon=self.hindsight_horizon)
+                self.learner_agent.training_step(batch)
+                with self.condition:
+                    self.updates += 1
+                    if self.updates % self.publish_interval == 0:
+                        self.published_weights = self.learner_agent.get_weights()
+                        self.version += 1
+                    self.condition.notify_all()
+        except Exception as error:
+            with self.condition:
+                self.error = error
+                self.condition.notify_all()
+
+    def actor_step(self, actor_agent=None):
+        """
+        called by the actor once per env step: lets the learner run and loads the last published weights
+        :param actor_agent: DeepQAgent - the agent used by the actor, None to not load the weights
+        """
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            self.actor_steps += 1
+            self.condition.notify_all()
+            if self.max_pending_updates is not None:
+                self.condition.wait_for(lambda: self.stopped or self.error is not None or
+                                        self._allowed_updates() - self.updates <= self.max_pending_updates)
+            weights = self.published_weights if self.version > self.actor_version else None
+            version = self.version
+        if weights is not None and actor_agent is not None:
+            actor_agent.set_weights(weights)
+            self.actor_version = version
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
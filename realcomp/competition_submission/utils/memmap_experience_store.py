@@ -0,0 +1,196 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+from competition_submission.utils.experience_store import ExperienceStore, STATE_FIELDS, SCALAR_FIELDS, FRAMES
+
+META_FILE = "meta.json"
+NOVELTY_PREFIX = "novelty_state_"
+STAGING_PREFIX = "staging_"
+# marks a row, of the ring buffer or of the staging row, that holds no complete experience
+EMPTY_ROW = -1
+
+
+class MemmapExperienceStore(ExperienceStore):
+    """
+    An ExperienceStore whose frame table and fields live in memory-mapped .npy files of a directory, so that the
+    replay memory can be much larger than the RAM: rows are paged in only when they are written or sampled.
+    An experience is first written to a one-row staging area and committed by writing its observation number last,
+    then copied to its slot the same way, so that a slot always holds either the old or the new experience. A store
+    created on a directory that already holds one reopens it: a committed staging row is copied again and the append
+    cursor continues after the newest experience, even if the process was killed without flushing. Only the state of
+    the novelty estimator is saved by flush() alone, a store reopened after a crash uses the one of the last flush.
+    The scalar fields, such as the novelty scores read by every goal selection and the observation numbers read by
+    every hindsight relabelling, are kept in ordinary arrays and written through to their files, with the commit of a
+    row or a new novelty score: they take memory_size*44 bytes of RAM, while a page fault of the sampled rows costs
+    a disk read.
+    """
+    def __init__(self, memory_size, directory, novelty_estimator=None, reserved_frames=0, embedder=None):
+        """
+        :param memory_size: int - the number of experiences of the ring buffer
+        :param directory: string - where the store files are kept, created if needed
+        :param novelty_estimator: NoveltyEstimator - as in ExperienceStore, its state is saved with the store
+        :param reserved_frames: int - as in ExperienceStore
+        :param embedder: FrameEmbedder - as in ExperienceStore
+        """
+        super().__init__(memory_size, novelty_estimator, reserved_frames, embedder=embedder)
+        self.directory = directory
+        self.staging = None
+        # the files of SCALAR_FIELDS, whose values are read from the arrays in RAM
+        self.scalar_files = {}
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._path(META_FILE)):
+            self._open()
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _allocate_array(self, name, shape, dtype):
+        array = np.lib.format.open_memmap(self._path(name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+        if name in SCALAR_FIELDS:
+            self.scalar_files[name] = array
+            return np.zeros(shape, dtype=dtype)
+        return array
+
+    def _allocate_fields(self, shapes, frame_shape, frame_rows=None):
+        """
+        creates the files of the store, the meta file is written last so that a store is reopened only if complete
+        """
+        super()._allocate_fields(shapes, frame_shape, frame_rows)
+        self.observation_numbers[:] = EMPTY_ROW
+        self.scalar_files["observation_numbers"][:] = EMPTY_ROW
+        self.staging = {}
+        for name, array in self._fields():
+            self.staging[name] = self._allocate_array(STAGING_PREFIX + name, (1,) + array.shape[1:], array.dtype)
+        self.staging["observation_numbers"][0] = EMPTY_ROW
+        for array in self._files():
+            array.flush()
+        self._write_meta()
+
+    def _fields(self):
+        """
+        :return: list - the name and memory-mapped file of each field
+        """
+        return [(name, getattr(self, name)) for name in STATE_FIELDS.keys()] + \
+            [(name, self.scalar_files[name]) for name in SCALAR_FIELDS.keys()]
+
+    def _files(self):
+        return [array for _, array in self._fields()] + list(self.staging.values())
+
+    def _resize_frames(self, rows):
+        """
+        writes the grown table to a new file that replaces the old one, which stays mapped until it is not used
+        """
+        tmp_file = self._path(FRAMES + ".npy.tmp")
+        frames = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.uint8, shape=(rows,) + self.frames.shape[1:])
+        frames[:len(self.frames)] = self.frames
+        frames.flush()
+        os.replace(tmp_file, self._path(FRAMES + ".npy"))
+        return frames
+
+    def _write_row(self, idx, row):
+        """
+        stages the experience, commits it by writing its observation number last, then copies it to its slot
+        """
+        self.staging["observation_numbers"][0] = EMPTY_ROW
+        for name, value in row.items():
+            if name != "observation_numbers":
+                self.staging[name][0] = value
+        self.staging["observation_numbers"][0] = row["observation_numbers"]
+        self._copy_staging(idx)
+
+    def _copy_staging(self, idx):
+        self.scalar_files["observation_numbers"][idx] = EMPTY_ROW
+        for name, array in self._fields():
+            if name != "observation_numbers":
+                array[idx] = self.staging[name][0]
+        self.scalar_files["observation_numbers"][idx] = self.staging["observation_numbers"][0]
+        for name in SCALAR_FIELDS.keys():
+            getattr(self, name)[idx] = self.scalar_files[name][idx]
+
+    def _write_scalar_files(self):
+        for name in SCALAR_FIELDS.keys():
+            self.scalar_files[name][:] = getattr(self, name)
+
+    def set_novelty_score(self, memory_id, novelty_score):
+        super().set_novelty_score(memory_id, novelty_score)
+        self.scalar_files["novelty_scores"][memory_id] = novelty_score
+
+    def _open(self):
+        """
+        reopens the store saved in the directory, completing the copy of the last committed experience
+        """
+        with open(self._path(META_FILE)) as f:
+            meta = json.load(f)
+        if meta["memory_size"] != self.memory_size:
+            raise ValueError("the store in %s has memory_size %d, not %d"
+                             % (self.directory, meta["memory_size"], self.memory_size))
+        self.staging = {}
+        for name in list(STATE_FIELDS.keys()) + list(SCALAR_FIELDS.keys()):
+            array = np.load(self._path(name + ".npy"), mmap_mode="r+")
+            if name in SCALAR_FIELDS:
+                self.scalar_files[name] = array
+                array = np.array(array)
+            setattr(self, name, array)
+            self.staging[name] = np.load(self._path(STAGING_PREFIX + name + ".npy"), mmap_mode="r+")
+        self.frames = np.load(self._path(FRAMES + ".npy"), mmap_mode="r+")
+        staged = int(self.staging["observation_numbers"][0])
+        if staged != EMPTY_ROW and self.observation_numbers[staged % self.memory_size] != staged:
+            self._copy_staging(staged % self.memory_size)
+        self.observation_number = int(self.observation_numbers.max()) + 1
+        novelty_state = {os.path.basename(filename)[len(NOVELTY_PREFIX):-len(".npy")]: np.load(filename)
+                         for filename in glob.glob(self._path(NOVELTY_PREFIX + "*.npy"))}
+        # a store that was never flushed starts over with a new novelty estimator
+        if len(novelty_state) > 0:
+            self.novelty_estimator.set_state(novelty_state)
+        self._rebuild_frame_references()
+        self._rebuild_priorities()
+        self.allocated = True
+
+    def restore(self, arrays, frames, observation_number, novelty_state):
+        super().restore(arrays, frames, observation_number, novelty_state)
+        self.observation_numbers[observation_number:] = EMPTY_ROW
+        self._write_scalar_files()
+        self.flush()
+
+    def _save(self, filename, array):
+        """
+        writes an in-memory array next to the memory-mapped ones, replacing the old file only when complete
+        """
+        tmp_file = self._path(filename + ".tmp")
+        with open(tmp_file, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_file, self._path(filename))
+
+    def _write_meta(self):
+        tmp_file = self._path(META_FILE + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump({"memory_size": self.memory_size, "observation_number": self.observation_number}, f)
+        os.replace(tmp_file, self._path(META_FILE))
+
+    def flush(self):
+        """
+        writes the memory-mapped pages and the state of the novelty estimator to disk
+        """
+        if not self.allocated:
+            return
+        with self.lock:
+            for array in self._files():
+                array.flush()
+            self.frames.flush()
+            for key, array in self.novelty_estimator.get_state().items():
+                self._save(NOVELTY_PREFIX + key + ".npy", array)
+            self._write_meta()
+
+    def close(self):
+        """
+        flushes the store and unmaps its files, the store can not be used afterwards
+        """
+        self.flush()
+        for name in list(STATE_FIELDS.keys()) + list(SCALAR_FIELDS.keys()) + [FRAMES]:
+            if hasattr(self, name):
+                delattr(self, name)
+        self.staging = None
+        self.scalar_files = {}
@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+
+from competition_submission.utils.experience_store import FRAME_FIELDS
+
+
+class PrefetchSampler:
+    """
+    Assembles replay batches in a background thread, so that sampling overlaps with stepping the environment.
+
+    The worker fills a fixed set of preallocated batches (the ready ones plus the one held by the caller) and hands
+    them over through a bounded queue. A batch returned by get_batch is reused once get_batch is called again, copy
+    it if it must be kept longer. An error of the worker stops it and is raised by get_batch.
+    """
+    def __init__(self, experience_store, batch_size, prefetch=2, max_staleness=None, prioritized=False,
+                 hindsight_probability=0.0, hindsight_horizon=50):
+        """
+        :param experience_store: ExperienceStore - the store to sample from, built with reserved_frames of at least
+                                 3*batch_size
+        :param batch_size: int - the number of experiences of a batch
+        :param prefetch: int - the number of batches kept ready
+        :param max_staleness: int - batches sampled more than max_staleness observations ago are dropped and sampled
+                              again, None to never drop them
+        :param prioritized: bool - as in ExperienceStore.get_memory_replay_batch
+        :param hindsight_probability: float - as in ExperienceStore.get_memory_replay_batch
+        :param hindsight_horizon: int - as in ExperienceStore.get_memory_replay_batch
+        """
+        if experience_store.reserved_frames < len(FRAME_FIELDS)*batch_size:
+            raise ValueError("the experience store must reserve at least %d frames"
+                             % (len(FRAME_FIELDS)*batch_size))
+        self.experience_store = experience_store
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.max_staleness = max_staleness
+        self.prioritized = prioritized
+        self.hindsight_probability = hindsight_probability
+        self.hindsight_horizon = hindsight_horizon
+        self.free_batches = queue.Queue()
+        self.ready_batches = queue.Queue(maxsize=prefetch)
+        self.held_batch = None
+        self.dropped_batches = 0
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self._fill_batches()
+        except Exception as error:
+            self.error = error
+
+    def _fill_batches(self):
+        store = self.experience_store
+        while len(store) == 0 and not self.stopped.is_set():
+            time.sleep(0.001)
+        for _ in range(self.prefetch + 1):
+            self.free_batches.put(store.allocate_batch(self.batch_size))
+
+        while not self.stopped.is_set():
+            try:
+                batch = self.free_batches.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            sampled_at = store.observation_number
+            memory_ids = store.sample_memory_ids(self.batch_size, self.prioritized)
+            store.fill_batch(memory_ids, batch)
+            if self.hindsight_probability > 0:
+                store.relabel_batch(batch, memory_ids, self.hindsight_probability, self.hindsight_horizon)
+            batch.sampled_at = sampled_at
+            while not self.stopped.is_set():
+                try:
+                    self.ready_batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def _is_stale(self, batch):
+        return self.max_staleness is not None and \
+            self.experience_store.observation_number - batch.sampled_at > self.max_staleness
+
+    def get_batch(self, timeout=None):
+        """
+        :param timeout: float - seconds to wait for a batch, forever if None
+        :return: ExperienceBatch - the oldest ready batch, raises queue.Empty on timeout and the error of the worker if
+                 it failed
+        """
+        if self.held_batch is not None:
+            self.free_batches.put(self.held_batch)
+            self.held_batch = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            batch = self._next_ready_batch(deadline)
+            if not self._is_stale(batch):
+                break
+            self.dropped_batches += 1
+            self.free_batches.put(batch)
+        self.held_batch = batch
+        return batch
+
+    def _next_ready_batch(self, deadline):
+        """
+        waits for a ready batch in short steps, so that a failure of the worker is noticed
+        """
+        while True:
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            try:
+                return self.ready_batches.get(timeout=max(wait, 0))
+            except queue.Empty:
+                if self.error is not None:
+                    raise self.error
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
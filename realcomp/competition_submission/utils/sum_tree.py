@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class SumTree:
+    """
+    A binary tree over a fixed number of non-negative priorities where every node holds the sum of its children.
+    Updating a priority and drawing an index with probability proportional to its priority are both O(log N).
+    The tree is stored as a flat array: node i has children 2i and 2i+1, the leaves start at self.leaves.
+    """
+    def __init__(self, capacity):
+        """
+        :param capacity: int - the number of priorities
+        """
+        self.capacity = capacity
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.depth = int(np.log2(self.leaves))
+        self.tree = np.zeros(2*self.leaves, dtype=np.float64)
+
+    def __getitem__(self, idx):
+        return self.tree[self.leaves + idx]
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, idx, priority):
+        """
+        sets one priority and the sums above it
+        :param idx: int - the index of the priority
+        :param priority: float - the new non-negative priority
+        """
+        node = self.leaves + idx
+        self.tree[node] = priority
+        node //= 2
+        while node >= 1:
+            self.tree[node] = self.tree[2*node] + self.tree[2*node + 1]
+            node //= 2
+
+    def build(self, priorities):
+        """
+        sets the first len(priorities) priorities, zeroes the others and recomputes all the sums in O(N)
+        :param priorities: ndarray - the new priorities
+        """
+        self.tree[:] = 0
+        self.tree[self.leaves:self.leaves + len(priorities)] = priorities
+        for level in range(self.depth - 1, -1, -1):
+            start = 2**level
+            self.tree[start:2*start] = self.tree[2*start:4*start:2] + self.tree[2*start + 1:4*start:2]
+
+    def find(self, values):
+        """
+        finds the indices whose cumulative priority range holds each value, all the values descend the tree together.
+        A value never descends into a subtree of zero priority, so that values rounded up to a sum, such as total(),
+        find the last positive priority before it instead of an empty leaf
+        :param values: ndarray - values in [0, total()], total() must be positive
+        :return: ndarray - the indices of the priorities
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(values.shape, dtype=np.int64)
+        for _ in range(self.depth):
+            left = self.tree[2*nodes]
+            go_right = (values >= left) & (self.tree[2*nodes + 1] > 0)
+            values -= left*go_right
+            nodes = 2*nodes + go_right
+        return nodes - self.leaves
+
+    def sample(self, size=None):
+        """
+        draws indices with probability proportional to their priority
+        :param size: int - the number of indices, or None for a single one
+        :return: int or ndarray
+        """
+        return self.find(np.random.uniform(0, self.total(), size=size))
@@ -1 +1,2 @@
 from realcomp.envs.realcomp_env import REALCompEnv, REALCompEnvSingleObj
+from realcomp.envs.vector_env import VectorREALCompEnv
@@ -0,0 +1,180 @@
+import os
+import glob
+import tempfile
+import xml.etree.ElementTree as ET
+import numpy as np
+import pybullet
+import pybullet_data
+from pybullet_utils import bullet_client
+
+"""
+Asset cache
+
+pybullet turns every (non concave) collision mesh into a convex hull of
+all its vertices each time a URDF is loaded, which makes up most of the
+loading time of the kuka arm. The cache holds a copy of the URDFs whose
+collision meshes are replaced by obj files that only contain the hull
+vertices, so that the same collision shapes are built from a fraction of
+the points. Visual meshes and textures are left untouched.
+
+Build it once after installing with:
+
+    python -m realcomp.envs.asset_cache
+"""
+
+URDF_DIR = "kuka_gripper_description/urdf"
+CACHE_DIR = "kuka_gripper_description/cache"
+PACKAGE_PREFIX = "package://"
+
+
+def cached_model(model_file, data_path=None):
+    '''
+    @model_file a URDF path relative to the data path, e.g.
+                "kuka_gripper_description/urdf/orange.urdf"
+    :return: the path of its cached version if it exists and is not older
+             than the source, model_file otherwise
+    '''
+    if data_path is None:
+        data_path = pybullet_data.getDataPath()
+
+    if os.path.dirname(os.path.normpath(model_file)) != os.path.normpath(URDF_DIR):
+        return model_file
+
+    cached_file = os.path.join(CACHE_DIR, os.path.basename(model_file))
+    source = os.path.join(data_path, model_file)
+    cached = os.path.join(data_path, cached_file)
+    if os.path.exists(cached) and os.path.exists(source) and \
+            os.path.getmtime(cached) >= os.path.getmtime(source):
+        return cached_file
+    return model_file
+
+
+def read_obj_groups(obj_file):
+    '''
+    @obj_file path of a wavefront obj file
+    :return: a list with the (n, 3) array of the vertices referenced by the
+             faces of each object of the file
+    '''
+    vertices = []
+    groups = [set()]
+    for line in open(obj_file):
+        tokens = line.split()
+        if len(tokens) == 0:
+            continue
+        if tokens[0] == "v":
+            vertices.append([float(x) for x in tokens[1:4]])
+        elif tokens[0] == "o" and len(groups[-1]) > 0:
+            groups.append(set())
+        elif tokens[0] == "f":
+            for token in tokens[1:]:
+                idx = int(token.split("/")[0])
+                groups[-1].add(idx - 1 if idx > 0 else len(vertices) + idx)
+
+    vertices = np.array(vertices)
+    return [vertices[sorted(group)] for group in groups if len(group) > 0]
+
+
+def write_obj(obj_file, groups):
+    ''' Write point sets as the objects of an obj file, with faces
+    that only serve to reference all the points
+    @groups a list of (n, 3) arrays of vertices
+    '''
+    with open(obj_file, "w") as f:
+        offset = 1
+        for i, points in enumerate(groups):
+            f.write("o hull_{}\n".format(i))
+            for x, y, z in points:
+                f.write("v {!r} {!r} {!r}\n".format(x, y, z))
+            n = len(points)
+            for j in range(0, n, 3):
+                face = [offset + min(j + k, n - 1) for k in range(3)]
+                f.write("f {} {} {}\n".format(*face))
+            offset += n
+
+
+def convex_hull(client, points, scale):
+    '''
+    @points a (n, 3) array
+    @scale the mesh scale the hull is computed at, as in the URDF
+    :return: the (m, 3) subset of points that are vertices of the hull
+             computed by bullet
+    '''
+    fd, tmp_file = tempfile.mkstemp(suffix=".obj")
+    os.close(fd)
+    try:
+        write_obj(tmp_file, [points])
+        shape = client.createCollisionShape(pybullet.GEOM_MESH,
+                fileName=tmp_file, meshScale=scale)
+        body = client.createMultiBody(baseMass=0,
+                baseCollisionShapeIndex=shape)
+        _, hull = client.getMeshData(body)
+        client.removeBody(body)
+    finally:
+        os.remove(tmp_file)
+
+    # bullet returns the hull vertices after a round trip through an
+    # integer grid: they are mapped back to the original points, so that
+    # the hull built from the cache is the same as from the full mesh
+    hull = np.array(hull)/scale
+    distances = np.square(hull[:, None, :] - points[None, :, :]).sum(-1)
+    return points[np.unique(np.argmin(distances, axis=1))]
+
+
+def resolve_mesh(filename, data_path, urdf_dir):
+    if filename.startswith(PACKAGE_PREFIX):
+        return os.path.join(data_path, filename[len(PACKAGE_PREFIX):])
+    return os.path.join(urdf_dir, filename)
+
+
+def build_asset_cache(data_path=None, verbose=False):
+    ''' Write the cached version of all the URDFs in URDF_DIR
+
+    @data_path the pybullet data path where the models were copied
+    :return: the list of the cached URDF files
+    '''
+    if data_path is None:
+        data_path = pybullet_data.getDataPath()
+
+    cache_dir = os.path.join(data_path, CACHE_DIR)
+    os.makedirs(os.path.join(cache_dir, "meshes"), exist_ok=True)
+
+    client = bullet_client.BulletClient(connection_mode=pybullet.DIRECT)
+    hulls = {}
+    cached_files = []
+    try:
+        for urdf in sorted(glob.glob(os.path.join(data_path, URDF_DIR, "*.urdf"))):
+            tree = ET.parse(urdf)
+            for mesh in tree.getroot().findall("./link/collision/geometry/mesh"):
+                mesh_file = resolve_mesh(mesh.get("filename"),
+                        data_path, os.path.dirname(urdf))
+                if not mesh_file.endswith(".obj"):
+                    continue
+                # bullet computes the hull of the scaled points, so
+                # each scale a mesh is used at gets its own hull
+                scale = [float(x) for x in mesh.get("scale", "1 1 1").split()]
+                key = (mesh_file, tuple(scale))
+                if key not in hulls:
+                    name = os.path.splitext(os.path.basename(mesh_file))[0]
+                    hull_file = os.path.join("meshes",
+                            "{}_hull_{}.obj".format(name, len(hulls)))
+                    groups = [convex_hull(client, points, scale)
+                            for points in read_obj_groups(mesh_file)]
+                    write_obj(os.path.join(cache_dir, hull_file), groups)
+                    hulls[key] = hull_file
+                    if verbose:
+                        print("{}: {} hull vertices".format(hull_file,
+                            sum(len(points) for points in groups)))
+                mesh.set("filename", hulls[key])
+
+            cached_file = os.path.join(cache_dir, os.path.basename(urdf))
+            tree.write(cached_file, encoding="utf-8", xml_declaration=True)
+            cached_files.append(cached_file)
+    finally:
+        client.disconnect()
+
+    return cached_files
+
+
+if __name__ == "__main__":
+    for cached_file in build_asset_cache(verbose=True):
+        print(cached_file)
@@ -0,0 +1,94 @@
+import os
+import sys
+import numpy as np
+
+"""
+Goal dataset
+
+A goal dataset is a directory holding one .npy file per field of the
+goals, each with one row per goal:
+
+    retinas.npy          uint8   (goals, height, width, 3)
+    initial_states.npy   float64 (goals, ...)
+    final_states.npy     float64 (goals, ...)
+
+The row number is the goal index. Files are opened memory-mapped and
+read-only, so goal k is paged in only when it is used and all the
+processes reading the same dataset share one copy in the page cache.
+"""
+
+RETINAS = "retinas.npy"
+INITIAL_STATES = "initial_states.npy"
+FINAL_STATES = "final_states.npy"
+
+
+class Goal:
+    def __init__(self, initial_state=[0, 0, 0],
+            final_state=[0, 0, 0], retina=None):
+        self.initial_state = initial_state
+        self.final_state = final_state
+        self.retina = retina
+
+
+class GoalDataset:
+    """ Read-only, memory-mapped access to a goal dataset
+    """
+
+    def __init__(self, path):
+        '''
+        @path the directory of the dataset
+        '''
+        self.path = path
+        self.retinas = np.load(os.path.join(path, RETINAS), mmap_mode="r")
+        self.initial_states = np.load(os.path.join(path, INITIAL_STATES),
+                mmap_mode="r")
+        self.final_states = np.load(os.path.join(path, FINAL_STATES),
+                mmap_mode="r")
+        assert len(self.retinas) == len(self.initial_states) == \
+                len(self.final_states)
+
+    def __len__(self):
+        return len(self.retinas)
+
+    def __getitem__(self, idx):
+        '''
+        :return: the Goal at row idx, its arrays are read-only views of
+                 the mapped files
+        '''
+        return Goal(initial_state=np.asarray(self.initial_states[idx]),
+                final_state=np.asarray(self.final_states[idx]),
+                retina=np.asarray(self.retinas[idx]))
+
+
+def save_goal_dataset(path, goals):
+    ''' Write a list of goals as a goal dataset
+    @path the directory of the dataset, created if needed
+    @goals a list of Goal objects, with retinas and states of the same
+           shape for all the goals
+    '''
+    os.makedirs(path, exist_ok=True)
+    fields = [
+            (RETINAS, np.uint8, lambda goal: goal.retina),
+            (INITIAL_STATES, np.float64, lambda goal: goal.initial_state),
+            (FINAL_STATES, np.float64, lambda goal: goal.final_state)]
+
+    for filename, dtype, field in fields:
+        shape = np.shape(field(goals[0]))
+        array = np.lib.format.open_memmap(os.path.join(path, filename),
+                mode="w+", dtype=dtype, shape=(len(goals),) + shape)
+        for i, goal in enumerate(goals):
+            array[i] = field(goal)
+        array.flush()
+        del array
+
+
+def convert_pickled_goals(pickled_file, path):
+    ''' Convert a goals_dataset.npy array of pickled Goal objects
+    into a goal dataset
+    '''
+    goals = np.load(pickled_file, allow_pickle=True)
+    save_goal_dataset(path, list(goals))
+
+
+if __name__ == "__main__":
+    convert_pickled_goals(sys.argv[1], sys.argv[2])
@@ -2,9 +2,12 @@ from pybullet_envs.scene_abstract import SingleRobotEmptyScene
 from pybullet_envs.env_bases import MJCFBaseBulletEnv
 import numpy as np
 import pybullet
+from pybullet_utils import bullet_client
 import gym 
 from .realcomp_robot import Kuka 
+from .goal_dataset import Goal, GoalDataset
 import sys, os
+from collections.abc import Mapping
 
 """
 Realcomp
@@ -13,12 +16,56 @@ Realcomp
 def DefaultRewardFunc(observation):
     return 0
 
-class Goal:
-    def __init__(self, initial_state=[0, 0, 0], 
-            final_state=[0, 0, 0], retina=None):
-        self.initial_state = initial_state
-        self.final_state = final_state
-        self.retina = retina
+class Observation(Mapping):
+    """ A read-only observation dict whose channels are computed on first
+    access and then cached
+
+    The observation expires when the env moves on (step or reset): from
+    then on only the channels already read are available, reading any
+    other one raises a RuntimeError instead of returning the state of a
+    later timestep. A controller that keeps an observation beyond the
+    step it was returned by must read the channels it will need before
+    the next call to step or reset, e.g. by copying them in a dict.
+    """
+
+    def __init__(self, channels, values=None):
+        '''
+        @channels dict mapping each key to the function computing its value
+        @values dict of the channels whose value is already known
+        '''
+        self._channels = channels
+        self._values = dict(values or {})
+        self.expired = False
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key not in self._channels:
+            raise KeyError(key)
+        if self.expired:
+            raise RuntimeError("channel '{}' was not read before the "
+                    "env moved on to the next timestep".format(key))
+        value = self._channels[key]()
+        self._values[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._channels)
+
+    def __len__(self):
+        return len(self._channels)
+
+    def compute(self):
+        ''' Compute all the channels not read yet
+        '''
+        for key in self._channels:
+            self[key]
+        return self
+
+    def expire(self):
+        self.expired = True
+        # drop the references to the env held by the channel functions
+        self._channels = dict.fromkeys(self._channels)
 
 class REALCompEnv(MJCFBaseBulletEnv):
     """ Create a REALCompetion environment inheriting by gym.env
@@ -28,9 +75,38 @@ class REALCompEnv(MJCFBaseBulletEnv):
     intrinsic_timesteps = int(1e7)
     extrinsic_timesteps = int(1e3)
     
-    def __init__(self, render=False):
+    def __init__(self, render=False, frame_skip=1, render_every=1,
+            lazy_observation=False, fast_reset=False, asset_cache=True,
+            connection_mode=None):
+        '''
+        @render open the pybullet GUI
+        @frame_skip number of physics substeps (of 5 ms each) for which each
+                    action is applied by a single step()
+        @render_every render the retina only once every render_every
+                      calls to step(), the last frame is returned in between
+        @lazy_observation compute each observation channel only when the
+                          controller reads it (see Observation); the
+                          channels not read before the next step or reset
+                          can not be read anymore
+        @fast_reset restore a snapshot of the scene on reset instead of
+                    reloading all the models (see Kuka.reset)
+        @asset_cache load the models from the asset cache if it was built
+        @connection_mode the pybullet connection mode of the physics client
+                         (e.g. pybullet.DIRECT), if None a GUI client if
+                         render else a client that connects to a shared
+                         memory server if there is one and runs DIRECT
+                         otherwise
+        '''
 
-        self.robot = Kuka()
+        self.frame_skip = frame_skip
+        self.render_every = render_every
+        self.lazy_observation = lazy_observation
+        self.retina = None
+        self.render_countdown = 0
+        self.observation = None
+        self.connection_mode = connection_mode
+
+        self.robot = Kuka(fast_reset=fast_reset, asset_cache=asset_cache)
         MJCFBaseBulletEnv.__init__(self, self.robot, render)
         
         self._cam_dist = 1.2
@@ -65,31 +141,74 @@ class REALCompEnv(MJCFBaseBulletEnv):
                 width=self._render_width,
                 height=self._render_height)
     
-    def set_eye(self, name, eye_pos=[0.01, 0, 1.2], target_pos=[0, 0, 0]):
+    def set_eye(self, name, eye_pos=[0.01, 0, 1.2], target_pos=[0, 0, 0],
+            renderer=pybullet.ER_BULLET_HARDWARE_OPENGL):
         ''' Initialize an eye camera
         @name the label of the created eye camera
+        @renderer pybullet.ER_BULLET_HARDWARE_OPENGL or pybullet.ER_TINY_RENDERER
         '''
-        cam = EyeCamera(eye_pos, target_pos)
+        cam = EyeCamera(eye_pos, target_pos, renderer=renderer)
         self.eyes[name] = cam
 
-    def set_goal(self):
+    def load_goals(self):
+        ''' Open the goal dataset, goals are read from the memory-mapped
+        task/goals_dataset directory one at a time
+        :return: the goals, indexed by goal index
+        '''
         if self.goals is None:
-            self.goals = np.load(
-                    os.path.join( 
-                        os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
-                        "task",
-                        "goals_dataset.npy"), allow_pickle=True)
+            path = os.path.join( 
+                    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                    "task",
+                    "goals_dataset")
+            if os.path.isdir(path):
+                self.goals = GoalDataset(path)
+            else:
+                # legacy array of pickled goals
+                self.goals = np.load(path + ".npy", allow_pickle=True)
             self.goal_idx = 0
-        goal = self.goals[self.goal_idx]
+        return self.goals
+
+    def set_goal(self, goal_idx=None):
+        ''' Set the next goal of the goal dataset
+        @goal_idx the index of the goal to set, the goal following the
+                  last one set if None
+        '''
+        self.load_goals()
+        if goal_idx is not None:
+            self.goal_idx = goal_idx
+        self.goal = self.goals[self.goal_idx]
         self.goal_idx += 1
 
         
     def create_single_player_scene(self, bullet_client):
         return SingleRobotEmptyScene(bullet_client, gravity=9.81, 
-                timestep=0.005, frame_skip=1)
+                timestep=0.005, frame_skip=self.frame_skip)
     
+    def expire_observation(self):
+        ''' Make the last observation unable to compute new channels,
+        to be called before the simulation state changes
+        '''
+        if self.observation is not None:
+            self.observation.expire()
+            self.observation = None
+
+    def connect(self):
+        ''' Create the physics client with connection_mode, set up as the
+        base env sets up the client it creates on the first reset
+        '''
+        self.ownsPhysicsClient = True
+        self._p = bullet_client.BulletClient(
+                connection_mode=self.connection_mode)
+        self._p.resetSimulation()
+        self._p.setPhysicsEngineParameter(deterministicOverlappingPairs=1)
+        self.physicsClientId = self._p._client
+        self._p.configureDebugVisualizer(pybullet.COV_ENABLE_GUI, 0)
+
     def reset(self):
 
+        self.expire_observation()
+        if self.physicsClientId < 0 and self.connection_mode is not None:
+            self.connect()
         super(REALCompEnv, self).reset()
         self._p.setGravity(0.,0.,-9.81)
         self.camera._p = self._p
@@ -101,6 +220,7 @@ class REALCompEnv(MJCFBaseBulletEnv):
                 self._cam_pitch, self._cam_pos)
 
         self.timestep = 0
+        self.retina = None
         
         return self.get_observation()
 
@@ -120,6 +240,14 @@ class REALCompEnv(MJCFBaseBulletEnv):
     def get_obj_pos(self, name):
         return self.robot.object_bodies[name].get_position()
 
+    def get_obj_states(self):
+        '''
+        :return: a (objects, 7) array with the position and the orientation
+                 quaternion of each object, in the order of
+                 self.robot.object_state_names
+        '''
+        return self.robot.object_states.copy()
+
     def get_contacts(self):
         return self.robot.get_contacts()
     
@@ -133,23 +261,34 @@ class REALCompEnv(MJCFBaseBulletEnv):
         '''
         reset positions if an object goes out of the limits
         '''
-        for obj in self.robot.used_objects:
-            x, y, z = self.robot.object_bodies[obj].get_position()
-            if not ( -0.2 < x < 0.2) or not ( -0.5 < y < 0.5) or z < 0.33:
-                self.robot.object_bodies[obj].reset_position(
-                        self.robot.object_poses[obj][:3])
+        x, y, z = self.robot.object_states[:, :3].T
+        out = (x <= -0.2) | (x >= 0.2) | (y <= -0.5) | (y >= 0.5) | (z < 0.33)
+        self.robot.reset_object_positions(out)
+
+    def get_last_retina(self):
+        '''
+        :return: the rgb_array of the eye, rendered again only if the last
+                 one is render_every or more steps old
+        '''
+        if self.retina is None or self.render_countdown < 0:
+            self.retina = self.get_retina()
+            self.render_countdown = self.render_every - 1
+        return self.retina
 
     def get_observation(self):
 
-        joints = self.robot.calc_state()
-        sensors = self.robot.get_touch_sensors()
-        retina = self.get_retina()
-        
-        observation = {
-                Kuka.ObsSpaces.JOINT_POSITIONS: joints,
-                Kuka.ObsSpaces.TOUCH_SENSORS: sensors,
-                Kuka.ObsSpaces.RETINA: retina,
-                Kuka.ObsSpaces.GOAL: self.goal.retina }
+        self.render_countdown -= 1
+
+        observation = Observation({
+                Kuka.ObsSpaces.JOINT_POSITIONS: self.robot.calc_state,
+                Kuka.ObsSpaces.TOUCH_SENSORS: self.robot.get_touch_sensors,
+                Kuka.ObsSpaces.RETINA: self.get_last_retina,
+                Kuka.ObsSpaces.GOAL: None},
+                values={Kuka.ObsSpaces.GOAL: self.goal.retina})
+
+        if not self.lazy_observation:
+            return dict(observation.compute())
+        self.observation = observation
 
         return observation
 
@@ -157,9 +296,11 @@ class REALCompEnv(MJCFBaseBulletEnv):
     def step(self, action):
         assert(not self.scene.multiplayer)
         
+        self.expire_observation()
         self.control_objects_limits()
         self.robot.apply_action(action)
         self.scene.global_step()  
+        self.robot.update_object_states()
 
         
         observation = self.get_observation()
@@ -176,7 +317,9 @@ class REALCompEnv(MJCFBaseBulletEnv):
 
         info = {}
         
-        self.timestep += 1
+        # timesteps are counted in physics steps, so that action
+        # repetition does not change the length of the phases
+        self.timestep += self.frame_skip
 
         return observation, reward, done, info
 
@@ -186,10 +329,23 @@ class REALCompEnvSingleObj(MJCFBaseBulletEnv):
         self.robot.used_objects = ["table", "orange"]
 
 
+def rgb_from_pixels(px, width, height):
+    ''' Convert the pixels returned by getCameraImage into a
+    contiguous uint8 HxWx3 array
+
+    The RGBA buffer is read as uint8 without any wider intermediate
+    (it is not copied at all when pybullet already returns a numpy
+    array) and the only copy is the one that drops the alpha channel.
+    '''
+    rgba = np.asarray(px, dtype=np.uint8).reshape(height, width, 4)
+    return np.ascontiguousarray(rgba[:, :, :3])
+
+
 class EnvCamera:
 
     def __init__(self, distance, yaw, pitch, roll, pos, 
-            fov=80, width=320, height=240):
+            fov=80, width=320, height=240,
+            renderer=pybullet.ER_BULLET_HARDWARE_OPENGL):
         
         self.dist = distance
         self.yaw = yaw
@@ -199,13 +355,22 @@ class EnvCamera:
         self.fov = fov
         self.render_width = width
         self.render_height = height
+        self.renderer = renderer
 
-    def render(self, bullet_client = None):
-        
-        if bullet_client is None:
-            bullet_client = self._p
+        self._matrices_key = None
+        self._view_matrix = None
+        self._proj_matrix = None
 
-        view_matrix = bullet_client.computeViewMatrixFromYawPitchRoll(
+    def update_matrices(self, bullet_client):
+        ''' Recompute view and projection matrices only if the camera
+        parameters changed since the last frame
+        '''
+        key = (self.dist, self.yaw, self.pitch, self.roll, tuple(self.pos),
+                self.fov, self.render_width, self.render_height)
+        if key == self._matrices_key:
+            return
+
+        self._view_matrix = bullet_client.computeViewMatrixFromYawPitchRoll(
                 cameraTargetPosition = self.pos,
                 distance=self.dist,
                 yaw=self.yaw,
@@ -213,26 +378,33 @@ class EnvCamera:
                 roll=self.roll,
                 upAxisIndex=2)
 
-        proj_matrix = bullet_client.computeProjectionMatrixFOV(
+        self._proj_matrix = bullet_client.computeProjectionMatrixFOV(
                 fov=self.fov, aspect=float(self.render_width)/self.render_height,
                 nearVal=0.1, farVal=100.0)
 
+        self._matrices_key = key
+
+    def render(self, bullet_client = None):
+        
+        if bullet_client is None:
+            bullet_client = self._p
+
+        self.update_matrices(bullet_client)
+
         (_, _, px, _, _) = bullet_client.getCameraImage(
                 width=self.render_width, height=self.render_height,
-                viewMatrix=view_matrix,
-                projectionMatrix=proj_matrix,
-                renderer=pybullet.ER_BULLET_HARDWARE_OPENGL
+                viewMatrix=self._view_matrix,
+                projectionMatrix=self._proj_matrix,
+                renderer=self.renderer
                 )
 
-        rgb_array = np.array(px).reshape(self.render_height, self.render_width, 4)
-        rgb_array = rgb_array[:, :, :3]
-
-        return rgb_array
+        return rgb_from_pixels(px, self.render_width, self.render_height)
      
 class EyeCamera:
 
     def __init__(self, eyePosition, targetPosition,
-            fov=80, width=320, height=240):
+            fov=80, width=320, height=240,
+            renderer=pybullet.ER_BULLET_HARDWARE_OPENGL):
         
         self.eyePosition = eyePosition
         self.targetPosition = targetPosition
@@ -240,8 +412,14 @@ class EyeCamera:
         self.fov = fov
         self.render_width = width
         self.render_height = height
+        self.renderer = renderer
         self._p = None
         self.pitch_roll = False
+
+        self._view_key = None
+        self._proj_key = None
+        self._view_matrix = None
+        self._proj_matrix = None
     
     def render(self, *args, **kargs):
         if self.pitch_roll is True:
@@ -249,6 +427,25 @@ class EyeCamera:
         else:
             return self.renderTarget(*args, **kargs)
 
+    def update_matrices(self, bullet_client):
+        ''' Recompute view and projection matrices only if the eye, the
+        target or the lens changed since the last frame
+        '''
+        view_key = (tuple(self.eyePosition), tuple(self.targetPosition),
+                tuple(self.upVector))
+        if view_key != self._view_key:
+            self._view_matrix = bullet_client.computeViewMatrix(
+                    cameraEyePosition = self.eyePosition,
+                    cameraTargetPosition = self.targetPosition,
+                    cameraUpVector=self.upVector)
+            self._view_key = view_key
+
+        proj_key = (self.fov, self.render_width, self.render_height)
+        if proj_key != self._proj_key:
+            self._proj_matrix = bullet_client.computeProjectionMatrixFOV(
+                    fov=self.fov, aspect=float(self.render_width)/self.render_height,
+                    nearVal=0.1, farVal=100.0)
+            self._proj_key = proj_key
 
     def renderTarget(self, targetPosition, bullet_client = None):
         
@@ -256,27 +453,16 @@ class EyeCamera:
             bullet_client = self._p
 
         self.targetPosition = targetPosition
-
-        view_matrix = bullet_client.computeViewMatrix(
-                cameraEyePosition = self.eyePosition,
-                cameraTargetPosition = self.targetPosition,
-                cameraUpVector=self.upVector)
-
-        proj_matrix = bullet_client.computeProjectionMatrixFOV(
-                fov=self.fov, aspect=float(self.render_width)/self.render_height,
-                nearVal=0.1, farVal=100.0)
+        self.update_matrices(bullet_client)
 
         (_, _, px, _, _) = bullet_client.getCameraImage(
                 width=self.render_width, height=self.render_height,
-                viewMatrix=view_matrix,
-                projectionMatrix=proj_matrix,
-                renderer=pybullet.ER_BULLET_HARDWARE_OPENGL
+                viewMatrix=self._view_matrix,
+                projectionMatrix=self._proj_matrix,
+                renderer=self.renderer
                 )
 
-        rgb_array = np.array(px).reshape(self.render_height, self.render_width, 4)
-        rgb_array = rgb_array[:, :, :3]
-
-        return rgb_array
+        return rgb_from_pixels(px, self.render_width, self.render_height)
             
     def renderPitchRoll(self, distance, roll, pitch, yaw, bullet_client = None):
         
@@ -301,13 +487,7 @@ class EyeCamera:
                 width=self.render_width, height=self.render_height,
                 viewMatrix=view_matrix,
                 projectionMatrix=proj_matrix,
-                renderer=pybullet.ER_BULLET_HARDWARE_OPENGL
+                renderer=self.renderer
                 )
 
-        rgb_array = np.array(px).reshape(self.render_height, self.render_width, 4)
-        rgb_array = rgb_array[:, :, :3]
-
-        return rgb_array
-            
-
-
+        return rgb_from_pixels(px, self.render_width, self.render_height)
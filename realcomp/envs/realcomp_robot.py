@@ -1,10 +1,17 @@
 from robot_bases import MJCFBasedRobot, URDFBasedRobot
 import numpy as np
+import pybullet
 import pybullet_data
 import os
 import gym
 from robot_bases import BodyPart
+from .asset_cache import cached_model
 
+# contact ERP of a new pybullet world (after resetSimulation), it is not
+# returned by getPhysicsEngineParameters
+DEFAULT_CONTACT_ERP = 0.08
+# engine parameters saved with the fast reset snapshot
+SNAPSHOT_PARAMETERS = ["fixedTimeStep", "numSubSteps", "numSolverIterations"]
 
 
 class Kuka(URDFBasedRobot):
@@ -27,6 +34,7 @@ class Kuka(URDFBasedRobot):
     num_kuka_joints = 7
     num_gripper_joints = 2
     num_touch_sensors = 4
+    touch_sensor_names = ["skin_00", "skin_01", "skin_10", "skin_11"]
     eye_width = 320
     eye_height = 240
     
@@ -36,7 +44,15 @@ class Kuka(URDFBasedRobot):
         RETINA = "retina"
         GOAL = "goal"
 
-    def __init__(self):
+    def __init__(self, fast_reset=False, asset_cache=True):
+        '''
+        @fast_reset restore a snapshot of the loaded scene on reset instead
+                    of reloading all the models (see reset)
+        @asset_cache load the models from the asset cache when it has been
+                     built (see asset_cache.build_asset_cache)
+        '''
+
+        self.asset_cache = asset_cache
 
         self.robot_position = [-0.8, 0, 0]
         self.contact_threshold = 0.1
@@ -44,7 +60,7 @@ class Kuka(URDFBasedRobot):
         self.action_dim = self.num_joints
         
         URDFBasedRobot.__init__(self, 
-                'kuka_gripper_description/urdf/kuka_gripper.urdf', 
+                self.model_file("kuka_gripper"), 
                 'kuka0', action_dim=self.action_dim, obs_dim=1)
               
         self.observation_space = gym.spaces.Dict({
@@ -53,9 +69,9 @@ class Kuka(URDFBasedRobot):
             self.ObsSpaces.TOUCH_SENSORS: gym.spaces.Box(
                 0, np.inf, [self.num_touch_sensors], dtype = float),
             self.ObsSpaces.RETINA: gym.spaces.Box(
-                0, 255, [Kuka.eye_height, Kuka.eye_width, 3], dtype = float),
+                0, 255, [Kuka.eye_height, Kuka.eye_width, 3], dtype = np.uint8),
             self.ObsSpaces.GOAL: gym.spaces.Box(
-                0, 255, [Kuka.eye_height, Kuka.eye_width, 3], dtype = float)})
+                0, 255, [Kuka.eye_height, Kuka.eye_width, 3], dtype = np.uint8)})
 
         self.target = "orange"
 
@@ -63,46 +79,85 @@ class Kuka(URDFBasedRobot):
         self.object_bodies = dict()
         self.robot_parts = {}
 
+        self.fast_reset = fast_reset
+        self.snapshot = None
+        self.snapshot_key = None
+        self.snapshot_parameters = None
+
  
     def reset(self, bullet_client):
+        ''' Reset the scene to its initial state
+
+        With fast_reset the models are loaded once and a pybullet state
+        snapshot is saved right after; following resets restore it, and
+        the full reload only happens again if the client or used_objects
+        changed.
+        '''
+        snapshot_key = (bullet_client._client, tuple(self.used_objects))
+        if self.fast_reset and self.snapshot is not None \
+                and self.snapshot_key == snapshot_key:
+            bullet_client.restoreState(self.snapshot)
+            # the scene configures the engine before the robot reset and a
+            # full reload puts back the defaults of resetSimulation, none of
+            # which are part of the saved state
+            bullet_client.setPhysicsEngineParameter(**self.snapshot_parameters)
+            bullet_client.setDefaultContactERP(DEFAULT_CONTACT_ERP)
+            # motor targets are not part of the saved state
+            for _,joint in self.jdict.items():
+                joint.reset_current_position(0, 0)
+            self.update_object_states()
+            return self.calc_state()
+
         bullet_client.resetSimulation()
+        self.snapshot = None
+        self.object_names = dict()
+        self.object_bodies = dict()
+        self.robot_parts = {}
         super(Kuka, self).reset(bullet_client)
+
+        if self.fast_reset:
+            self.snapshot = bullet_client.saveState()
+            self.snapshot_key = snapshot_key
+            parameters = bullet_client.getPhysicsEngineParameters()
+            self.snapshot_parameters = {name: parameters[name]
+                    for name in SNAPSHOT_PARAMETERS}
+
         return self.calc_state()
     
     def get_contacts(self, forces=False):    
+        '''
+        :return: dict mapping each robot part in contact to the list of the
+                 touched object names (or (name, force) tuples if forces)
+        '''
+
+        self.contacts.update()
 
         contact_dict = {}
-        for part_name, part in self.parts.items():         
-            contacts = []
-            for contact in part.contact_list():
-                if abs(contact[8]) < self.contact_threshold:
-                    name = self.object_names[contact[2]] 
-                    if not forces:
-                        if part_name in contact_dict.keys():
-                            contact_dict[part_name].append(name)
-                        else:
-                            contact_dict[part_name]= [name]  
-                    else:
-                        force = contact[9]
-                        if part_name in contact_dict.keys():
-                            contact_dict[part_name].append([name, force])
-                        else:
-                            contact_dict[part_name] = [(name, force)]  
+        for link, body, force in zip(self.contacts.links,
+                self.contacts.bodies, self.contacts.forces):
+            part_name = self.robot_parts[link]
+            name = self.object_names[body]
+            contact = (name, force) if forces else name
+            contact_dict.setdefault(part_name, []).append(contact)
 
         return contact_dict
     
-    def get_touch_sensors(self): 
+    def get_touch_sensors(self, contact_matrix=False): 
+        '''
+        @contact_matrix also return the per-part contact matrix (see
+                        ContactEngine.contact_matrix) from the same query
+        :return: the max force on each of the touch sensors
+        '''
         
-        sensors = np.zeros(4)
-        contacts = self.get_contacts(forces=True)
-        for i, skin in enumerate(["skin_00", "skin_01", "skin_10", "skin_11"]):
-            if skin in contacts.keys():
-                cnts = contacts[skin]   
-                if len(cnts) > 0:
-                    force = np.max([cnt[1] for cnt in cnts])
-                    sensors[i] = force
-                
-            return sensors 
+        self.contacts.update()
+        sensors = self.contacts.touch_sensors()
+        if contact_matrix:
+            return sensors, self.contacts.contact_matrix()
+        return sensors 
+
+    def get_contact_matrix(self):
+        self.contacts.update()
+        return self.contacts.contact_matrix()
 
     def robot_specific_reset(self, bullet_client):
 
@@ -113,9 +168,7 @@ class Kuka(URDFBasedRobot):
 
         for obj_name in self.used_objects:
             pos = self.object_poses[obj_name]
-            obj = get_object(bullet_client,
-                    "kuka_gripper_description/urdf/{}.urdf".format(obj_name),
-                    *pos)
+            obj = get_object(bullet_client, self.model_file(obj_name), *pos)
             self.object_bodies[obj_name] = obj
             self.object_names.update({obj.bodies[0]: obj_name})
         
@@ -125,33 +178,188 @@ class Kuka(URDFBasedRobot):
         for name, part in self.parts.items():
             self.robot_parts.update({part.bodyPartIndex: name})
 
+        self.resolve_joint_indices()
+        self.build_object_states()
+
+        self.contacts = ContactEngine(bullet_client,
+                self.robot_body.bodies[self.robot_body.bodyIndex],
+                {name: part.bodyPartIndex for name, part in self.parts.items()},
+                self.touch_sensor_names, self.object_names,
+                self.contact_threshold)
+
+    def build_object_states(self):
+        ''' Build the table of the object poses, one row per used object
+        '''
+        self.object_state_names = list(self.used_objects)
+        self.object_ids = [self.object_bodies[name].bodies[0]
+                for name in self.object_state_names]
+        self.object_initial_positions = np.array([
+            self.object_poses[name][:3] for name in self.object_state_names])
+        self.object_states = np.zeros([len(self.object_ids), 7])
+        self.update_object_states()
+
+    def update_object_states(self):
+        ''' Refresh the object table in place, each row holds the
+        position and the orientation quaternion of an object
+        '''
+        for row, body in zip(self.object_states, self.object_ids):
+            pos, orn = self._p.getBasePositionAndOrientation(body)
+            row[:3] = pos
+            row[3:] = orn
+
+    def reset_object_positions(self, mask):
+        ''' Move the selected objects back to their initial positions,
+        keeping their current orientation
+        @mask boolean array with one element per row of the object table
+        '''
+        for idx in np.flatnonzero(mask):
+            self.object_states[idx, :3] = self.object_initial_positions[idx]
+            self._p.resetBasePositionAndOrientation(self.object_ids[idx],
+                    self.object_states[idx, :3], self.object_states[idx, 3:])
+
+    def model_file(self, name):
+        '''
+        :return: the path of the URDF of a model, relative to the data path
+        '''
+        model_file = "kuka_gripper_description/urdf/{}.urdf".format(name)
+        if self.asset_cache:
+            return cached_model(model_file)
+        return model_file
+
+    def resolve_joint_indices(self):
+        ''' Precompute the joint indices, the action components and the
+        signs used to read the state and to write the action in one call
+        '''
+        self.robot_id = self.robot_body.bodies[self.robot_body.bodyIndex]
+
+        kuka_joints = ["lbr_iiwa_joint_%d"%(i+1)
+                for i in range(self.num_kuka_joints)]
+        kuka_ids = list(range(self.num_kuka_joints))
+
+        # joint_positions: 7 kuka joints, then the two gripper joints
+        # of finger 0 (the second one is read with opposite sign)
+        state_joints = kuka_joints + [
+                "base_to_finger00_joint", "finger00_to_finger01_joint"]
+        self.state_joint_ids = [self.jdict[name].jointIndex
+                for name in state_joints]
+        self.state_signs = np.ones(len(state_joints))
+        self.state_signs[-1] = -1
+
+        # action: the two gripper components drive both fingers
+        action_joints = kuka_joints + [
+                "base_to_finger00_joint", "base_to_finger10_joint",
+                "finger00_to_finger01_joint", "finger10_to_finger11_joint"]
+        self.action_joint_ids = [self.jdict[name].jointIndex
+                for name in action_joints]
+        self.action_sources = np.array(kuka_ids + [7, 7, 8, 8])
+        self.action_signs = np.array([1.]*(self.num_kuka_joints + 2)
+                + [-1., -1.])
+
     def apply_action(self, a):
         assert (np.isfinite(a).all())
         assert(len(a) == self.num_joints)
 
-        a[:-2] = np.maximum(-np.pi*0.5, np.minimum(np.pi*0.5, a[:-2]))
-        a[-2:] = np.maximum( 0, np.minimum(np.pi*0.5, a[-2:]))
+        # the action is clipped in place as the caller may rely on it
+        a = np.asarray(a)
+        np.clip(a[:-2], -np.pi*0.5, np.pi*0.5, out=a[:-2])
+        np.clip(a[-2:], 0, np.pi*0.5, out=a[-2:])
         a[-1] = np.maximum( 0, np.minimum(2*a[-2], a[-1]))
  
-        for i,j in enumerate(a[:-2]):
-            self.jdict["lbr_iiwa_joint_%d"%(i+1)].set_position(j)
-        
-        self.jdict["base_to_finger00_joint"].set_position(a[-2])
-        self.jdict["base_to_finger10_joint"].set_position(a[-2])
-        self.jdict["finger00_to_finger01_joint"].set_position(-a[-1])
-        self.jdict["finger10_to_finger11_joint"].set_position(-a[-1])
+        self._p.setJointMotorControlArray(self.robot_id,
+                self.action_joint_ids, pybullet.POSITION_CONTROL,
+                targetPositions=a[self.action_sources]*self.action_signs)
 
     def calc_state(self):
-        joints = []
-        for i in range(self.num_kuka_joints):
-            joints.append(self.jdict["lbr_iiwa_joint_%d"%(i+1)].get_position())
-        joints.append(self.jdict["base_to_finger00_joint"].get_position())
-        joints.append(-self.jdict["finger00_to_finger01_joint"].get_position())
+        states = self._p.getJointStates(self.robot_id, self.state_joint_ids)
+        joints = np.array([state[0] for state in states])
+        joints *= self.state_signs
         
         return joints 
 
 
 
+class ContactEngine:
+    """ Read all the contacts of the robot with a single getContactPoints
+    call and dispatch them to touch sensors and parts through lookup tables
+    indexed by link and body ids
+    """
+
+    def __init__(self, bullet_client, robot_body, part_links, sensor_names,
+            object_names, contact_threshold):
+        '''
+        @robot_body the pybullet id of the robot body
+        @part_links dict mapping each robot part name to its link index
+        @sensor_names names of the parts that act as touch sensors
+        @object_names dict mapping the pybullet body ids to object names
+        @contact_threshold contacts farther than this are ignored
+        '''
+        self._p = bullet_client
+        self.robot_body = robot_body
+        self.contact_threshold = contact_threshold
+
+        # link tables are indexed by link + 1, so that the base (-1) is 0
+        self.part_names = sorted(part_links, key=part_links.get)
+        links = np.array([part_links[name] for name in self.part_names])
+        self.link_to_part = np.full(links.max() + 2, -1, dtype=int)
+        self.link_to_part[links + 1] = np.arange(len(links))
+
+        self.link_to_sensor = np.full(links.max() + 2, -1, dtype=int)
+        for i, name in enumerate(sensor_names):
+            self.link_to_sensor[part_links[name] + 1] = i
+        self.num_sensors = len(sensor_names)
+
+        body_ids = sorted(object_names)
+        self.object_names = [object_names[body] for body in body_ids]
+        self.body_to_object = np.full(body_ids[-1] + 1, -1, dtype=int)
+        self.body_to_object[body_ids] = np.arange(len(body_ids))
+
+        self.bodies = np.zeros(0, dtype=int)
+        self.links = np.zeros(0, dtype=int)
+        self.forces = np.zeros(0)
+
+    def update(self):
+        ''' Query the contact points of the robot and keep the ones closer
+        than contact_threshold
+        '''
+        points = self._p.getContactPoints(bodyA=self.robot_body)
+        if len(points) == 0:
+            self.bodies = np.zeros(0, dtype=int)
+            self.links = np.zeros(0, dtype=int)
+            self.forces = np.zeros(0)
+            return
+
+        # columns: bodyB, linkIndexA, contactDistance, normalForce
+        data = np.array([(c[2], c[3], c[8], c[9]) for c in points])
+        data = data[np.abs(data[:, 2]) < self.contact_threshold]
+        self.bodies = data[:, 0].astype(int)
+        self.links = data[:, 1].astype(int)
+        self.forces = data[:, 3]
+
+    def touch_sensors(self):
+        '''
+        :return: the max normal force on each touch sensor
+        '''
+        sensors = np.zeros(self.num_sensors)
+        idx = self.link_to_sensor[self.links + 1]
+        on_sensor = idx >= 0
+        np.maximum.at(sensors, idx[on_sensor], self.forces[on_sensor])
+        return sensors
+
+    def contact_matrix(self):
+        '''
+        :return: a (parts, objects) array with the max normal force between
+                 each robot part (in part_names order) and each object
+                 (in object_names order)
+        '''
+        matrix = np.zeros((len(self.part_names), len(self.object_names)))
+        known = self.bodies < len(self.body_to_object)
+        rows = self.link_to_part[self.links[known] + 1]
+        cols = self.body_to_object[self.bodies[known]]
+        valid = (rows >= 0) & (cols >= 0)
+        np.maximum.at(matrix, (rows[valid], cols[valid]),
+                self.forces[known][valid])
+        return matrix
+
  
 def get_object(bullet_client, object_file, x, y, z, roll=0, pitch=0, yaw=0):
 
@@ -0,0 +1,195 @@
+import multiprocessing as mp
+import numpy as np
+import pybullet
+from .realcomp_env import REALCompEnv
+from .realcomp_robot import Kuka
+
+"""
+Vectorized REALComp environment
+
+N REALCompEnv instances are run in worker processes, each with its own
+DIRECT pybullet client. Actions and observations are exchanged through
+preallocated shared-memory buffers, so that no array is ever pickled: the
+pipes only carry one-byte commands.
+"""
+
+_CMD_RESET = b"r"
+_CMD_STEP = b"s"
+_CMD_SET_GOAL = b"g"
+_CMD_CLOSE = b"c"
+
+
+def _obs_layout(observation_space):
+    ''' Shapes and dtypes of the observation channels of a single env
+    '''
+    return {key: (tuple(space.shape), space.dtype)
+            for key, space in observation_space.spaces.items()}
+
+
+def _shared_array(shape, dtype):
+    ''' Allocate a lock-free shared buffer big enough for an array
+    @shape the shape of the array
+    @dtype the numpy dtype of the array
+    '''
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return mp.RawArray('b', max(nbytes, 1))
+
+
+def _as_array(buffer, shape, dtype):
+    ''' A numpy view of a shared buffer (no copy)
+    '''
+    return np.frombuffer(buffer, dtype=dtype,
+            count=int(np.prod(shape))).reshape(shape)
+
+
+def _worker(idx, conn, env_class, env_attrs, connection_mode, buffers, layout,
+        num_envs):
+    ''' Worker loop: owns one env and writes its observations in row
+    idx of the shared buffers
+    '''
+    obs = {key: _as_array(buffers[key], (num_envs,) + shape, dtype)[idx]
+            for key, (shape, dtype) in layout.items()}
+    actions = _as_array(buffers["actions"], (num_envs, Kuka.num_joints),
+            np.float64)
+    rewards = _as_array(buffers["rewards"], (num_envs,), np.float64)
+    dones = _as_array(buffers["dones"], (num_envs,), np.uint8)
+
+    env = env_class(render=False, connection_mode=connection_mode)
+    for name, value in env_attrs.items():
+        setattr(env, name, value)
+
+    def write(observation):
+        for key in layout.keys():
+            np.copyto(obs[key], observation[key], casting="unsafe")
+
+    try:
+        while True:
+            cmd = conn.recv_bytes()
+            if cmd == _CMD_STEP:
+                # apply_action clips in place, never touch the shared row
+                observation, reward, done, _ = env.step(actions[idx].copy())
+                rewards[idx] = reward
+                dones[idx] = done
+                if done:
+                    observation = env.reset()
+                write(observation)
+            elif cmd == _CMD_RESET:
+                write(env.reset())
+            elif cmd == _CMD_SET_GOAL:
+                env.set_goal()
+                obs[Kuka.ObsSpaces.GOAL][:] = env.goal.retina
+            elif cmd == _CMD_CLOSE:
+                break
+            conn.send_bytes(cmd)
+    finally:
+        env.close()
+        conn.close()
+
+
+class VectorREALCompEnv:
+    """ Run N REALCompEnv instances in parallel worker processes
+
+    Observations are returned as a dict of stacked arrays indexed by the
+    Kuka.ObsSpaces keys (e.g. retina has shape (N, 240, 320, 3)). The
+    arrays are views of the shared buffers: they are overwritten by the
+    next call to step() or reset(), copy them if they must be kept.
+
+    When an env is done it is reset immediately and the observation
+    returned for it is the first one of the new episode.
+    """
+
+    def __init__(self, num_envs, env_class=REALCompEnv, env_attrs=None,
+            context=None, connection_mode=pybullet.DIRECT):
+        '''
+        @num_envs number of parallel environments
+        @env_class the environment class built in every worker
+        @env_attrs dict of attributes set on each env after construction
+                   (e.g. {"intrinsic_timesteps": 1000})
+        @context the multiprocessing start method (default of the platform
+                 if None)
+        @connection_mode the pybullet connection mode of the physics client
+                         of every env
+        '''
+        self.num_envs = num_envs
+        self.closed = False
+
+        probe = Kuka()
+        self.action_space = probe.action_space
+        self.observation_space = probe.observation_space
+
+        layout = _obs_layout(self.observation_space)
+        self._buffers = {key: _shared_array((num_envs,) + shape, dtype)
+                for key, (shape, dtype) in layout.items()}
+        self._buffers["actions"] = _shared_array(
+                (num_envs, Kuka.num_joints), np.float64)
+        self._buffers["rewards"] = _shared_array((num_envs,), np.float64)
+        self._buffers["dones"] = _shared_array((num_envs,), np.uint8)
+
+        self.observations = {key: _as_array(self._buffers[key],
+            (num_envs,) + shape, dtype) for key, (shape, dtype) in layout.items()}
+        self.actions = _as_array(self._buffers["actions"],
+                (num_envs, Kuka.num_joints), np.float64)
+        self.rewards = _as_array(self._buffers["rewards"],
+                (num_envs,), np.float64)
+        self.dones = _as_array(self._buffers["dones"],
+                (num_envs,), np.uint8)
+
+        ctx = mp.get_context(context)
+        self._conns = []
+        self._procs = []
+        for idx in range(num_envs):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker,
+                    args=(idx, child_conn, env_class, dict(env_attrs or {}),
+                        connection_mode, self._buffers, layout, num_envs),
+                    daemon=True)
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+
+    def _broadcast(self, cmd):
+        for conn in self._conns:
+            conn.send_bytes(cmd)
+        for conn in self._conns:
+            conn.recv_bytes()
+
+    def reset(self):
+        ''' Reset all the environments
+        :return: the dict of stacked observations
+        '''
+        self._broadcast(_CMD_RESET)
+        return self.observations
+
+    def set_goal(self):
+        ''' Call set_goal() on all the environments
+        '''
+        self._broadcast(_CMD_SET_GOAL)
+
+    def step(self, actions):
+        '''
+        @actions array of shape (num_envs, num_joints)
+        :return: (observations, rewards, dones, infos)
+        '''
+        np.copyto(self.actions, actions)
+        self._broadcast(_CMD_STEP)
+        infos = [{} for _ in range(self.num_envs)]
+        return self.observations, self.rewards, self.dones.astype(bool), infos
+
+    def close(self):
+        if self.closed:
+            return
+        for conn in self._conns:
+            try:
+                conn.send_bytes(_CMD_CLOSE)
+            except (BrokenPipeError, EOFError):
+                pass
+        for proc in self._procs:
+            proc.join()
+        for conn in self._conns:
+            conn.close()
+        self.closed = True
+
+    def __del__(self):
+        if not getattr(self, "closed", True):
+            self.close()
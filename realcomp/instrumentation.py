@@ -0,0 +1,256 @@
+import csv
+import functools
+import json
+import os
+import threading
+import time
+
+"""
+Per-phase timing of the simulation loop
+
+A Profiler times the hot phases by replacing the methods that implement
+them with timed wrappers on the instrumented objects. Nothing is wrapped
+until instrument_env (or wrap) is called, so a run that does not use a
+profiler executes exactly the same code as before.
+
+    profiler = Profiler("timings.csv", interval=10000)
+    instrument_env(profiler, env)
+    ...
+    profiler.close()
+
+Phases nest: observation includes the joint read, contact query and
+retina render it triggers (unless the observation is lazy, then they are
+timed when the controller reads the channels).
+"""
+
+ENV_STEP = "env_step"
+RESET = "reset"
+PHYSICS = "physics"
+RENDER = "retina_render"
+CONTACTS = "contact_query"
+JOINT_READ = "joint_read"
+JOINT_WRITE = "joint_write"
+OBSERVATION = "observation"
+DECISION = "controller_decision"
+STORE_INSERT = "store_insert"
+BATCH_SAMPLING = "batch_sampling"
+TRAINING = "training_step"
+
+# histogram buckets per octave of nanoseconds
+SUBBUCKETS = 4
+SUBBUCKET_BITS = 2
+
+CSV_COLUMNS = ["time", "phase", "count", "total_s", "mean_us", "p50_us",
+        "p90_us", "p99_us", "min_us", "max_us"]
+
+
+class Histogram:
+    """ Log-scale histogram of durations in nanoseconds, SUBBUCKETS
+    buckets per power of two, with the exact count, total, min and max
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def add(self, ns):
+        bits = ns.bit_length()
+        if bits > SUBBUCKET_BITS:
+            bucket = (bits << SUBBUCKET_BITS) | \
+                    ((ns >> (bits - SUBBUCKET_BITS - 1)) & (SUBBUCKETS - 1))
+        else:
+            bucket = ns
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+
+    @staticmethod
+    def bucket_value(bucket):
+        ''' :return: the middle of the range of durations of the bucket
+        '''
+        bits = bucket >> SUBBUCKET_BITS
+        if bits == 0:
+            return bucket
+        low = (SUBBUCKETS | (bucket & (SUBBUCKETS - 1))) << \
+                (bits - SUBBUCKET_BITS - 1)
+        return low + (1 << (bits - SUBBUCKET_BITS - 1))/2
+
+    def percentile(self, q):
+        '''
+        @q the percentile, in [0, 100]
+        :return: the estimated duration in nanoseconds
+        '''
+        if self.count == 0:
+            return 0
+        rank = q/100*self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                value = self.bucket_value(bucket)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count,
+                "total_s": self.total*1e-9,
+                "mean_us": self.total/max(self.count, 1)*1e-3,
+                "p50_us": self.percentile(50)*1e-3,
+                "p90_us": self.percentile(90)*1e-3,
+                "p99_us": self.percentile(99)*1e-3,
+                "min_us": (self.min or 0)*1e-3,
+                "max_us": self.max*1e-3}
+
+
+class Profiler:
+    """ Aggregates the durations of the wrapped methods and the counters
+    into one histogram per phase, and reports them every interval env
+    steps to a file and/or a callback. Each report covers the steps since
+    the previous one.
+    """
+
+    def __init__(self, path=None, interval=10000, callback=None):
+        '''
+        @path file the reports are appended to, as csv rows if it ends
+              with .csv, else as json lines
+        @interval number of env steps (calls of a method wrapped with
+                  tick=True) between two reports
+        @callback function called with each report, a dict with the time,
+                  the steps, the counters and the summary of each phase
+        '''
+        self.path = path
+        self.interval = interval
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.steps = 0
+        self.wrapped = []
+
+    def record(self, phase, ns):
+        with self.lock:
+            histogram = self.histograms.get(phase)
+            if histogram is None:
+                histogram = self.histograms[phase] = Histogram()
+            histogram.add(ns)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def wrap(self, owner, name, phase, tick=False, after=None):
+        ''' Replace the method name of owner by a timed wrapper, on the
+        instance only. An already wrapped method is left as it is.
+        @owner the instrumented object
+        @name the name of the method
+        @phase the phase the durations are recorded in
+        @tick count each call as an env step, and report every interval
+        @after function called after each call, outside the timing
+        '''
+        method = getattr(owner, name)
+        if getattr(method, "_profiler", None) is self:
+            return
+        clock = time.perf_counter_ns
+        record = self.record
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = clock()
+            result = method(*args, **kwargs)
+            record(phase, clock() - start)
+            if after is not None:
+                after()
+            if tick:
+                self.tick()
+            return result
+
+        timed._profiler = self
+        self.wrapped.append((owner, name, vars(owner).get(name)))
+        setattr(owner, name, timed)
+
+    def unwrap(self):
+        ''' Restore all the wrapped methods
+        '''
+        for owner, name, original in reversed(self.wrapped):
+            if original is not None:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+        self.wrapped = []
+
+    def tick(self):
+        self.steps += 1
+        if self.steps % self.interval == 0:
+            self.report()
+
+    def report(self):
+        ''' Write the report of the steps since the last one and start a
+        new one
+        :return: the report
+        '''
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+            counters, self.counters = self.counters, {}
+        report = {"time": time.time(), "steps": self.steps,
+                "counters": counters,
+                "phases": {phase: histogram.summary()
+                    for phase, histogram in sorted(histograms.items())}}
+        if self.path is not None:
+            self._write(report)
+        if self.callback is not None:
+            self.callback(report)
+        return report
+
+    def _write(self, report):
+        if self.path.endswith(".csv"):
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(CSV_COLUMNS)
+                for phase, summary in report["phases"].items():
+                    writer.writerow([report["time"], phase] +
+                            [summary[column] for column in CSV_COLUMNS[2:]])
+                for name, value in report["counters"].items():
+                    writer.writerow([report["time"], name, value] +
+                            [""]*(len(CSV_COLUMNS) - 3))
+        else:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(report) + "\n")
+
+    def close(self):
+        ''' Report the steps since the last report and unwrap everything
+        '''
+        if any(histogram.count for histogram in self.histograms.values()) \
+                or self.counters:
+            self.report()
+        self.unwrap()
+
+
+def instrument_env(profiler, env):
+    ''' Time the phases of a REALCompEnv (or of a gym wrapper of it).
+    The scene and the contact engine are created on reset, their methods
+    are wrapped again after each reset.
+    '''
+    env = getattr(env, "unwrapped", env)
+
+    def instrument_scene():
+        if env.scene is not None:
+            profiler.wrap(env.scene, "global_step", PHYSICS)
+        if getattr(env.robot, "contacts", None) is not None:
+            profiler.wrap(env.robot.contacts, "update", CONTACTS)
+
+    profiler.wrap(env, "step", ENV_STEP, tick=True)
+    profiler.wrap(env, "reset", RESET, after=instrument_scene)
+    profiler.wrap(env, "get_observation", OBSERVATION)
+    profiler.wrap(env, "get_retina", RENDER)
+    profiler.wrap(env.robot, "apply_action", JOINT_WRITE)
+    profiler.wrap(env.robot, "calc_state", JOINT_READ)
+    instrument_scene()
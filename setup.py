@@ -28,5 +28,10 @@ setup(name='REALComp',
             'install': MyInstall,
             'egg_info': MyEgg
             },
-        install_requires=['gym', 'pybullet', 'numpy']
+        install_requires=['gym==0.17.3', 'pybullet==3.2.7', 'numpy==1.26.4'],
+        extras_require={
+            # the DeepQAgent of the competition submission
+            'agent': ['tensorflow==2.21.0'],
+            'test': ['pytest==9.1.1'],
+            }
         )
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the submission is imported as competition_submission, with realcomp/ on the path
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "realcomp"))
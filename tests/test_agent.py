@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from competition_submission.agent import DeepQAgent
+from competition_submission.consts import RETINA, JOINT_POSITIONS, TOUCH_SENSORS
+from competition_submission.utils.experience_store import ExperienceStore, Goal
+
+RETINA_SHAPE = (12, 16, 3)
+
+
+def build_model(num_joints=9, num_sensors=4):
+    retina = tf.keras.Input(RETINA_SHAPE)
+    goal = tf.keras.Input(RETINA_SHAPE)
+    joint_positions = tf.keras.Input((num_joints,))
+    touch_sensors = tf.keras.Input((num_sensors,))
+    # each input goes through its own weights, so that a swapped or unscaled input changes the output
+    x = tf.keras.layers.Concatenate()([tf.keras.layers.Flatten()(retina), 2*tf.keras.layers.Flatten()(goal),
+                                       joint_positions, touch_sensors])
+    return tf.keras.Model([retina, goal, joint_positions, touch_sensors], tf.keras.layers.Dense(1)(x))
+
+
+def test_inference_and_training_see_the_same_inputs():
+    rng = np.random.RandomState(0)
+    observations = [{RETINA: rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8),
+                     JOINT_POSITIONS: rng.randn(9), TOUCH_SENSORS: rng.rand(4)} for _ in range(2)]
+    goal = Goal(rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8), None, None)
+    store = ExperienceStore(4)
+    store.insert_observation(observations[0], observations[1], goal, np.zeros(9))
+    agent = DeepQAgent(build_model())
+
+    training_output = agent.model(agent.training_inputs(store.get_batch(np.array([0]))), training=False).numpy()[0]
+    np.testing.assert_allclose(agent.choose_action(observations[0], goal.retina), training_output, rtol=1e-5)
+    np.testing.assert_allclose(agent.choose_action_predict(observations[0], goal.retina), training_output, rtol=1e-5)
+
+
+def test_training_step_updates_a_compiled_model():
+    rng = np.random.RandomState(0)
+    store = ExperienceStore(8)
+    goal = Goal(rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8), None, None)
+    for k in range(4):
+        store.insert_observation({RETINA: rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8),
+                                  JOINT_POSITIONS: rng.randn(9), TOUCH_SENSORS: rng.rand(4)},
+                                 {RETINA: rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8),
+                                  JOINT_POSITIONS: rng.randn(9), TOUCH_SENSORS: rng.rand(4)}, goal, np.zeros(9))
+    model = build_model()
+    model.compile(optimizer="sgd", loss="mse")
+    agent = DeepQAgent(model)
+    weights = agent.get_weights()
+
+    loss = agent.training_step(store.get_batch(np.arange(4)))
+    assert np.all(np.isfinite(loss))
+    assert any(not np.array_equal(before, after) for before, after in zip(weights, agent.get_weights()))
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from competition_submission.utils.checkpoint import Checkpointer, SLOTS, META_FILE
+from competition_submission.utils.experience_store import ExperienceStore, STATE_FIELDS, SCALAR_FIELDS
+
+from test_experience_store import fill
+
+MEMORY_SIZE = 30
+
+
+def snapshot(store):
+    return {name: getattr(store, name).copy() for name in list(STATE_FIELDS.keys()) + list(SCALAR_FIELDS.keys())}
+
+
+def test_incremental_checkpoints_restore_the_store(tmp_path):
+    store = ExperienceStore(MEMORY_SIZE)
+    checkpointer = Checkpointer(str(tmp_path), store)
+    written_rows = []
+    write_fields = checkpointer._write_fields
+    checkpointer._write_fields = lambda slot, layouts, new_ids, *args: \
+        written_rows.append(len(new_ids)) or write_fields(slot, layouts, new_ids, *args)
+
+    snapshots = {}
+    for k in range(5):
+        fill(store, 10)
+        # decays the novelty score of an old experience in place
+        store.select_new_goal()
+        assert checkpointer.checkpoint()
+        checkpointer.wait()
+        snapshots[store.observation_number] = snapshot(store)
+    # each slot only writes the experiences inserted since its own last checkpoint
+    assert written_rows == [10, 20, 20, 20, 20]
+
+    for slot in range(len(SLOTS)):
+        restored = ExperienceStore(MEMORY_SIZE)
+        restorer = Checkpointer(str(tmp_path), restored)
+        latest = restorer.latest()
+        assert restorer.restore()
+        for name, array in snapshots[restored.observation_number].items():
+            np.testing.assert_array_equal(getattr(restored, name), array, err_msg=name)
+        # a crash while the latest checkpoint is written leaves the other one
+        os.remove(os.path.join(str(tmp_path), latest, META_FILE))
+
+
+def test_resume_restores_the_agent_of_the_controller(tmp_path, monkeypatch):
+    pytest.importorskip("tensorflow")
+    from competition_submission.agent import DeepQAgent
+    import competition_submission.my_controller as my_controller
+    from test_agent import build_model
+    from test_controller import make_controller
+
+    monkeypatch.setattr(my_controller, "MAX_MEMORY_SIZE", MEMORY_SIZE)
+    controllers = []
+    for k in range(2):
+        controller = make_controller()
+        # the agent is set after the controller is built, as in demo_run
+        controller.set_agent(DeepQAgent(build_model()))
+        controller.initialize_experience_store()
+        controllers.append(controller)
+    trained, resumed = controllers
+    fill(trained.experience_store, 5)
+    checkpointer = Checkpointer(str(tmp_path), trained.experience_store, trained)
+    assert checkpointer.checkpoint()
+    checkpointer.wait()
+
+    assert Checkpointer(str(tmp_path), resumed.experience_store, resumed).restore()
+    for expected, weights in zip(trained.agent.get_weights(), resumed.agent.get_weights()):
+        np.testing.assert_array_equal(weights, expected)
+    for controller in controllers:
+        controller.close()
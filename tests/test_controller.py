@@ -0,0 +1,43 @@
+import numpy as np
+from gym import spaces
+
+from competition_submission.consts import RETINA
+from competition_submission.my_controller import ControllerWrapper
+from competition_submission.utils.experience_store import Goal
+
+
+def make_controller():
+    return ControllerWrapper(spaces.Box(-np.pi, np.pi, shape=(9,), dtype=np.float64))
+
+
+def test_state_is_close_to_goal_on_uint8_frames():
+    controller = make_controller()
+    retina = np.full((240, 320, 3), 100, dtype=np.uint8)
+    controller.goal = Goal(retina, None, None)
+    assert controller._state_is_close_to_goal({RETINA: retina.copy()})
+    assert not controller._state_is_close_to_goal({RETINA: retina + np.uint8(16)})
+
+
+def test_default_controller_allocates_its_store():
+    controller = make_controller()
+    observation = {RETINA: np.zeros((240, 320, 3), dtype=np.uint8), "goal": np.zeros((240, 320, 3), dtype=np.uint8),
+                   "joint_positions": np.zeros(9), "touch_sensors": np.zeros(4)}
+    for t in range(3):
+        controller.step(observation, 0, False)
+    assert controller.experience_store.observation_number == 2
+
+
+def test_controller_runs_on_a_lazy_env(monkeypatch):
+    import gym
+    import pybullet
+    import realcomp
+    import competition_submission.my_controller as my_controller
+
+    monkeypatch.setattr(my_controller, "MAX_MEMORY_SIZE", 100)
+    env = gym.make("REALComp-v0", lazy_observation=True, connection_mode=pybullet.DIRECT)
+    controller = ControllerWrapper(env.action_space)
+    observation, reward, done = env.reset(), 0, False
+    for t in range(10):
+        observation, reward, done, _ = env.step(controller.step(observation, reward, done))
+    controller.close()
+    env.close()
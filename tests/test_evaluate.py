@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "realcomp", "competition_submission"))
+
+import evaluate
+from realcomp.envs.goal_dataset import Goal, GoalDataset, save_goal_dataset
+from realcomp.envs.realcomp_env import REALCompEnv
+
+
+def test_results_do_not_depend_on_the_number_of_workers(tmp_path, monkeypatch):
+    rng = np.random.RandomState(0)
+    # a goal retina holds no zero, as the controller tells the goals of the extrinsic trials from the empty one
+    save_goal_dataset(str(tmp_path), [Goal(np.zeros(3), np.zeros(3), rng.randint(1, 256, (240, 320, 3)))
+                                      for _ in range(4)])
+    # the workers are forked and inherit the patches
+    monkeypatch.setattr(REALCompEnv, "load_goals", lambda env: setattr(env, "goals", GoalDataset(str(tmp_path)))
+                        or env.goals)
+    monkeypatch.setattr(sys.modules[evaluate.Controller.__module__], "MAX_MEMORY_SIZE", 100)
+
+    results = {}
+    for workers in [1, 2]:
+        trials = sorted(evaluate.evaluate(range(4), workers, extrinsic_timesteps=20), key=lambda r: r["goal_idx"])
+        results[workers] = [(result["goal_idx"], result["steps"], result["retina_mse"]) for result in trials]
+    assert len(results[1]) == 4
+    assert results[1] == results[2]
+
+
+class ExitingController:
+    def __init__(self, action_space):
+        # a worker killed without the chance to report an error
+        os._exit(3)
+
+
+def test_a_worker_that_exits_raises(tmp_path, monkeypatch):
+    save_goal_dataset(str(tmp_path), [Goal(np.zeros(3), np.zeros(3), np.ones((240, 320, 3))) for _ in range(2)])
+    monkeypatch.setattr(REALCompEnv, "load_goals", lambda env: setattr(env, "goals", GoalDataset(str(tmp_path)))
+                        or env.goals)
+
+    with pytest.raises(RuntimeError, match="worker 0 exited with code 3"):
+        list(evaluate.evaluate(range(2), 2, ExitingController, extrinsic_timesteps=20, poll_interval=0.1))
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from competition_submission.consts import RETINA, JOINT_POSITIONS, TOUCH_SENSORS
+from competition_submission.utils.experience_store import ExperienceStore, Goal, INITIAL_FRAMES, STATE_FIELDS, \
+    SCALAR_FIELDS
+from competition_submission.utils.frame_codec import ZlibFrameCodec
+from competition_submission.utils.memmap_experience_store import MemmapExperienceStore
+
+
+def observation(k):
+    retina = np.full((4, 6, 3), k % 251, dtype=np.uint8)
+    retina[0, 0, 0] = k // 251
+    return {RETINA: retina, JOINT_POSITIONS: np.full(9, k, dtype=np.float64),
+            TOUCH_SENSORS: np.zeros(4)}
+
+
+def fill(store, count):
+    goal = Goal(observation(-1)[RETINA], None, None)
+    for k in range(store.observation_number, store.observation_number + count):
+        # distinct initial and result frames: two new frames per experience
+        store.insert_observation(observation(2*k), observation(2*k + 1), goal, np.zeros(9))
+
+
+@pytest.mark.parametrize("kind", ["ram", "compressed", "memmap"])
+def test_frame_table_grows_on_demand(kind, tmp_path):
+    memory_size = INITIAL_FRAMES
+    if kind == "memmap":
+        store = MemmapExperienceStore(memory_size, str(tmp_path))
+    else:
+        store = ExperienceStore(memory_size, frame_codec=ZlibFrameCodec() if kind == "compressed" else None)
+    fill(store, 1)
+    assert len(store.frames) == INITIAL_FRAMES
+    fill(store, 3*memory_size)
+    assert INITIAL_FRAMES < len(store.frames) <= store.max_frames
+
+    ids = np.arange(memory_size)
+    batch = store.get_batch(ids)
+    k = batch.observation_numbers
+    for i in range(len(ids)):
+        np.testing.assert_array_equal(batch.initial_retinas[i], observation(2*k[i])[RETINA])
+        np.testing.assert_array_equal(batch.result_retinas[i], observation(2*k[i] + 1)[RETINA])
+
+
+def test_compressed_frame_tables_are_closed():
+    store = ExperienceStore(20, frame_codec=ZlibFrameCodec())
+    fill(store, 10)
+    frames = store.frames
+    frame_ids = np.flatnonzero(store.frame_references)
+    decoded = np.zeros(frames.shape, dtype=np.uint8)
+    decoded[frame_ids] = frames.take(frame_ids)
+    store.restore({name: getattr(store, name).copy() for name in list(STATE_FIELDS) + list(SCALAR_FIELDS)}, decoded,
+                  store.observation_number, store.novelty_estimator.get_state())
+    # the replaced table can not decode anymore
+    with pytest.raises(RuntimeError):
+        frames.take([0])
+    store.get_memory_replay_batch(4)
+    store.close()
+    with pytest.raises(RuntimeError):
+        store.get_memory_replay_batch(4)
+
+
+def test_relabeled_goals_are_reached_later_in_the_same_trajectory():
+    np.random.seed(0)
+    store = ExperienceStore(40)
+    # trajectories of 10 experiences, each pursuing its own goal; the first ones are evicted
+    for k in range(50):
+        goal = Goal(observation(-2 - k//10)[RETINA], None, None)
+        store.insert_observation(observation(2*k), observation(2*k + 1), goal, np.zeros(9))
+    memory_ids = np.arange(len(store))
+    batch = store.get_batch(memory_ids)
+    store.relabel_batch(batch, memory_ids, 1.0, 5)
+
+    observation_numbers = store.observation_numbers[memory_ids]
+    # the result joint positions of experience k are 2k + 1
+    goal_numbers = (batch.goal_joint_positions[:, 0].astype(np.int64) - 1)//2
+    offsets = goal_numbers - observation_numbers
+    assert np.all((offsets >= 0) & (offsets <= 5))
+    assert np.all(goal_numbers < store.observation_number)
+    assert np.all(goal_numbers//10 == observation_numbers//10)
+    assert np.any(offsets > 0)
+    np.testing.assert_array_equal(batch.goal_retinas, [observation(2*k + 1)[RETINA] for k in goal_numbers])
+    # an experience relabeled with its own result reached its goal
+    assert np.any(offsets == 0)
+    np.testing.assert_array_equal(batch.rewards[offsets == 0], 0)
+    assert np.all(batch.rewards[offsets > 0] > 0)
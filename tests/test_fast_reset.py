@@ -0,0 +1,33 @@
+import gym
+import numpy as np
+import pytest
+
+import realcomp
+
+
+def rollouts(fast_reset, frame_skip, episodes=2, steps=100):
+    ''' Joint positions and object poses of a seeded random walk in each
+    episode, without rendering the retina
+    '''
+    env = gym.make("REALComp-v0", fast_reset=fast_reset, frame_skip=frame_skip, lazy_observation=True)
+    trajectories = []
+    for episode in range(episodes):
+        env.reset()
+        rng = np.random.RandomState(episode)
+        action = np.zeros(9)
+        trajectory = []
+        for t in range(steps):
+            action += 0.1*np.pi*rng.randn(9)
+            observation, _, _, _ = env.step(action)
+            trajectory.append(np.concatenate([observation["joint_positions"], env.get_obj_states().ravel()]))
+        trajectories.append(np.array(trajectory))
+    env.close()
+    return trajectories
+
+
+@pytest.mark.parametrize("frame_skip", [1, 3])
+def test_fast_reset_matches_full_reload(frame_skip):
+    full = rollouts(False, frame_skip)
+    fast = rollouts(True, frame_skip)
+    for full_episode, fast_episode in zip(full, fast):
+        np.testing.assert_array_equal(fast_episode, full_episode)
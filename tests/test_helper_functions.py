@@ -0,0 +1,16 @@
+import numpy as np
+
+from competition_submission.utils.helper_functions import mse, batch_mse
+
+
+def test_mse_of_uint8_frames_does_not_wrap_around():
+    y = np.full((240, 320, 3), 100, dtype=np.uint8)
+    yh = y + np.uint8(16)
+    assert mse(y, yh) == 256
+    assert mse(yh, y) == 256
+
+
+def test_batch_mse_of_uint8_frames_does_not_wrap_around():
+    y = np.full((2, 24, 32, 3), 100, dtype=np.uint8)
+    yh = y + np.uint8(16)
+    np.testing.assert_array_equal(batch_mse(y, yh), [256, 256])
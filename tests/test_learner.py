@@ -0,0 +1,80 @@
+import threading
+
+import numpy as np
+import pytest
+
+from competition_submission.consts import RETINA, JOINT_POSITIONS, TOUCH_SENSORS
+from competition_submission.utils.experience_store import ExperienceStore, Goal
+from competition_submission.utils.learner import AsyncLearner
+
+from test_experience_store import fill
+
+
+class RecordingStore(ExperienceStore):
+    def __init__(self, memory_size):
+        super().__init__(memory_size)
+        self.sampled = threading.Event()
+        self.arguments = None
+
+    def get_memory_replay_batch(self, batch_size, prioritized=False, hindsight_probability=0.0, hindsight_horizon=50):
+        self.arguments = (hindsight_probability, hindsight_horizon)
+        self.sampled.set()
+        return super().get_memory_replay_batch(batch_size, prioritized, hindsight_probability, hindsight_horizon)
+
+
+class NullAgent:
+    def training_step(self, batch):
+        pass
+
+    def get_weights(self):
+        return []
+
+
+def test_learner_samples_with_the_hindsight_settings():
+    store = RecordingStore(16)
+    fill(store, 8)
+    learner = AsyncLearner(store, NullAgent(), 4, updates_per_step=1, hindsight_probability=0.5, hindsight_horizon=7)
+    try:
+        learner.actor_step()
+        assert store.sampled.wait(10)
+    finally:
+        learner.close()
+    assert learner.error is None
+    assert store.arguments == (0.5, 7)
+
+
+def test_learner_trains_a_deep_q_agent():
+    pytest.importorskip("tensorflow")
+    from competition_submission.agent import DeepQAgent
+    from test_agent import build_model, RETINA_SHAPE
+
+    rng = np.random.RandomState(0)
+    store = ExperienceStore(16)
+    goal = Goal(rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8), None, None)
+    for k in range(8):
+        store.insert_observation({RETINA: rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8),
+                                  JOINT_POSITIONS: rng.randn(9), TOUCH_SENSORS: rng.rand(4)},
+                                 {RETINA: rng.randint(0, 256, RETINA_SHAPE).astype(np.uint8),
+                                  JOINT_POSITIONS: rng.randn(9), TOUCH_SENSORS: rng.rand(4)}, goal, np.zeros(9))
+    agents = []
+    for k in range(2):
+        model = build_model()
+        model.compile(optimizer="sgd", loss="mse")
+        agents.append(DeepQAgent(model))
+    actor_agent, learner_agent = agents
+    learner_agent.set_weights(actor_agent.get_weights())
+    initial_weights = actor_agent.get_weights()
+
+    # the actor waits for each update, so that the learner has run 4 of them after 4 actor steps
+    learner = AsyncLearner(store, learner_agent, 4, updates_per_step=1, publish_interval=2, max_pending_updates=0)
+    try:
+        for step in range(4):
+            learner.actor_step(actor_agent)
+        learner.actor_step(actor_agent)
+    finally:
+        learner.close()
+    assert learner.error is None
+    assert learner.updates >= 4 and learner.version >= 2
+    for published, actor in zip(learner.published_weights, actor_agent.get_weights()):
+        np.testing.assert_array_equal(published, actor)
+    assert any(not np.array_equal(before, after) for before, after in zip(initial_weights, actor_agent.get_weights()))
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from competition_submission.utils.experience_store import ExperienceStore, FIELDS, FRAME_FIELDS
+from competition_submission.utils.memmap_experience_store import MemmapExperienceStore
+
+from test_experience_store import fill
+
+MEMORY_SIZE = 20
+# the frame ids of a reopened store may differ, the frames they refer to may not
+EXPERIENCE_FIELDS = [name for name in FIELDS if name not in FRAME_FIELDS]
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingArray:
+    def __setitem__(self, key, value):
+        raise Crash()
+
+
+def assert_same_experiences(store, reference, fields=EXPERIENCE_FIELDS):
+    assert store.observation_number == reference.observation_number
+    ids = np.arange(len(reference))
+    batch, expected = store.get_batch(ids), reference.get_batch(ids)
+    for name in fields:
+        np.testing.assert_array_equal(getattr(batch, name), getattr(expected, name), err_msg=name)
+
+
+def test_reopen_without_flush(tmp_path):
+    store = MemmapExperienceStore(MEMORY_SIZE, str(tmp_path))
+    reference = ExperienceStore(MEMORY_SIZE)
+    for count in [30, 15]:
+        fill(store, count)
+        fill(reference, count)
+        if count == 30:
+            store.flush()
+    # the process is killed: the store is neither flushed nor closed
+    reopened = MemmapExperienceStore(MEMORY_SIZE, str(tmp_path))
+    assert_same_experiences(reopened, reference)
+
+    # the novelty state is the one of the last flush, the scores of the new experiences differ
+    fill(reopened, 7)
+    fill(reference, 7)
+    assert_same_experiences(reopened, reference, [name for name in EXPERIENCE_FIELDS if name != "novelty_scores"])
+
+
+@pytest.mark.parametrize("committed", [False, True])
+def test_crash_during_insert(committed, tmp_path):
+    store = MemmapExperienceStore(MEMORY_SIZE, str(tmp_path))
+    reference = ExperienceStore(MEMORY_SIZE)
+    fill(store, 25)
+    fill(reference, 25)
+    if committed:
+        # killed while the staged experience is copied to its slot
+        store.actions = CrashingArray()
+        fill(reference, 1)
+    else:
+        # killed while the experience is staged
+        store.staging["actions"] = CrashingArray()
+    with pytest.raises(Crash):
+        fill(store, 1)
+
+    reopened = MemmapExperienceStore(MEMORY_SIZE, str(tmp_path))
+    assert_same_experiences(reopened, reference)
+
+
+def test_scalar_fields_are_read_from_ram_and_written_through(tmp_path):
+    store = MemmapExperienceStore(MEMORY_SIZE, str(tmp_path))
+    reference = ExperienceStore(MEMORY_SIZE)
+    fill(store, 25)
+    fill(reference, 25)
+    assert not isinstance(store.novelty_scores, np.memmap)
+    assert isinstance(store.actions, np.memmap)
+    # the decayed novelty score of the selected goal reaches its file without a flush
+    store.set_novelty_score(3, 0.5)
+    reference.set_novelty_score(3, 0.5)
+
+    reopened = MemmapExperienceStore(MEMORY_SIZE, str(tmp_path))
+    assert_same_experiences(reopened, reference)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from competition_submission.utils.embedding_index import FrameEmbedder
+from competition_submission.utils.novelty import KnnNoveltyEstimator
+
+SHAPE = (16, 16, 3)
+
+
+def frame(level, rng):
+    return np.clip(level + rng.randint(-8, 9, SHAPE), 0, 255).astype(np.uint8)
+
+
+def test_knn_novelty_orders_frames_by_distance_to_the_seen_ones():
+    rng = np.random.RandomState(0)
+    estimator = KnnNoveltyEstimator(100, FrameEmbedder(downsample=1, dim=None), k=3)
+    scores = [estimator.insert(frame(64, rng)) for _ in range(20)]
+    # a frame seen again is less novel than the first ones
+    assert scores[0] == 1.0
+    assert scores[-1] < scores[1]
+    assert estimator.score(frame(64, rng)) < estimator.score(frame(128, rng)) < estimator.score(frame(255, rng))
+
+
+def test_knn_novelty_forgets_the_frames_past_its_capacity():
+    rng = np.random.RandomState(0)
+    estimator = KnnNoveltyEstimator(10, FrameEmbedder(downsample=1, dim=None), k=3)
+    for _ in range(10):
+        estimator.insert(frame(64, rng))
+    familiar = estimator.score(frame(64, rng))
+    for _ in range(10):
+        estimator.insert(frame(192, rng))
+    assert len(estimator.index) == 10
+    assert estimator.score(frame(64, rng)) > familiar
+    assert estimator.score(frame(192, rng)) < 2*familiar
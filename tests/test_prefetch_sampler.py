@@ -0,0 +1,48 @@
+import queue
+
+import pytest
+
+from competition_submission.utils.experience_store import ExperienceStore
+from competition_submission.utils.prefetch_sampler import PrefetchSampler
+
+from test_experience_store import fill
+
+BATCH_SIZE = 4
+
+
+class FailingStore(ExperienceStore):
+    def fill_batch(self, memory_ids, batch):
+        raise ValueError("fill failed")
+
+
+def test_get_batch_returns_batches():
+    store = ExperienceStore(16, reserved_frames=3*BATCH_SIZE)
+    fill(store, 8)
+    sampler = PrefetchSampler(store, BATCH_SIZE)
+    try:
+        batch = sampler.get_batch(timeout=10)
+        assert batch.batch_size == BATCH_SIZE
+    finally:
+        sampler.close()
+
+
+def test_get_batch_raises_the_error_of_the_worker():
+    store = FailingStore(16, reserved_frames=3*BATCH_SIZE)
+    fill(store, 8)
+    sampler = PrefetchSampler(store, BATCH_SIZE)
+    try:
+        with pytest.raises(ValueError, match="fill failed"):
+            sampler.get_batch()
+        assert not sampler.thread.is_alive()
+    finally:
+        sampler.close()
+
+
+def test_get_batch_times_out():
+    store = ExperienceStore(16, reserved_frames=3*BATCH_SIZE)
+    sampler = PrefetchSampler(store, BATCH_SIZE)
+    try:
+        with pytest.raises(queue.Empty):
+            sampler.get_batch(timeout=0.2)
+    finally:
+        sampler.close()
@@ -0,0 +1,28 @@
+import numpy as np
+
+from competition_submission.utils.sum_tree import SumTree
+
+
+def test_a_partly_filled_tree_only_finds_filled_leaves():
+    tree = SumTree(10)
+    tree.build(np.array([0.1, 0.2, 0.3, 0.4, 0.5]))
+    # total() is the upper edge of the last range, the leaves past it are empty
+    assert tree.find([0.0, 0.1, 0.45, tree.total()]).tolist() == [0, 1, 2, 4]
+    assert tree.find(np.nextafter(tree.total(), 2)) == 4
+    np.random.seed(0)
+    assert set(tree.sample(10000).tolist()) == {0, 1, 2, 3, 4}
+
+
+def test_updated_priorities_are_found():
+    tree = SumTree(10)
+    tree.build(np.array([0.1, 0.2, 0.3, 0.4, 0.5]))
+    tree.update(4, 0.0)
+    tree.update(2, 0.0)
+    tree.update(6, 1.0)
+    assert tree.total() == 0.1 + 0.2 + 0.4 + 1.0
+    # a value on the boundary of a zero priority skips it
+    assert tree.find([0.1 + 0.2, tree.total()]).tolist() == [3, 6]
+    np.random.seed(0)
+    counts = np.bincount(tree.sample(20000), minlength=10)
+    assert counts[[2, 4, 5, 7, 8, 9]].sum() == 0
+    np.testing.assert_allclose(counts[[0, 1, 3, 6]]/20000, np.array([0.1, 0.2, 0.4, 1.0])/1.7, atol=0.02)
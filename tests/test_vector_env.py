@@ -0,0 +1,31 @@
+import numpy as np
+import pybullet
+
+from realcomp.envs.realcomp_env import REALCompEnv
+from realcomp.envs.vector_env import VectorREALCompEnv
+
+
+class ConnectionEnv(REALCompEnv):
+    """ reports the connection method of its client in its reward """
+
+    def step(self, action):
+        observation, reward, done, info = super().step(action)
+        return observation, self._p.getConnectionInfo()["connectionMethod"], done, info
+
+
+def test_env_uses_connection_mode():
+    env = REALCompEnv(connection_mode=pybullet.DIRECT)
+    env.reset()
+    assert env._p.getConnectionInfo()["connectionMethod"] == pybullet.DIRECT
+    env.close()
+
+
+def test_vector_env_workers_run_direct():
+    env = VectorREALCompEnv(2, env_class=ConnectionEnv)
+    try:
+        observations = env.reset()
+        assert observations["retina"].shape[0] == 2
+        _, rewards, _, _ = env.step(np.zeros((2,) + env.action_space.shape))
+        np.testing.assert_array_equal(rewards, pybullet.DIRECT)
+    finally:
+        env.close()